@@ -0,0 +1,148 @@
+import numpy as np
+from env import build_lines
+
+X, O, EMPTY = 1, -1, 0
+
+
+class BatchEphemeralTicTacToeEnv:
+    """Steps many Ephemeral Tic-Tac-Toe games at once on stacked NumPy arrays.
+
+    Rules, rewards and termination match EphemeralTicTacToeEnv game by game.
+    Cells hold 1 (X), -1 (O) or 0 (empty) and players are encoded the same way.
+    Finished games are reset automatically; the terminal observation is
+    returned in info["final_observation"].
+    """
+
+    def __init__(self, num_envs, grid_size=3, lifespan_x=6, lifespan_o=6, max_steps=None, seed=None, win_length=3):
+        self.num_envs = num_envs
+        self.grid_size = grid_size
+        self.lifespan_x = lifespan_x
+        self.lifespan_o = lifespan_o
+        self.win_length = win_length
+        self.max_steps = max_steps
+        self.n_cells = grid_size * grid_size
+        self.rng = np.random.default_rng(seed)
+        self.lines = build_lines(grid_size, win_length)
+        self.cell_lines = np.zeros((self.n_cells, len(self.lines)), dtype=bool)
+        for line, cells in enumerate(self.lines):
+            self.cell_lines[cells, line] = True
+        self.board = np.zeros((num_envs, self.n_cells), dtype=np.int8)
+        self.ages = np.zeros((num_envs, self.n_cells), dtype=np.int32)
+        self.current_player = np.zeros(num_envs, dtype=np.int8)
+        self.move_count = np.zeros(num_envs, dtype=np.int64)
+        self.episode_steps = np.zeros(num_envs, dtype=np.int64)
+        self.starting_player = None
+
+    def reset(self, starting_player=None):
+        """Reset every game and return the stacked initial observations.
+
+        starting_player is "X", "O" or None for a random starter per game; it
+        is also used for the automatic resets of finished games.
+        """
+        self.starting_player = starting_player
+        self._reset_games(np.arange(self.num_envs))
+        return self._get_observation()
+
+    def _reset_games(self, idx):
+        self.board[idx] = EMPTY
+        self.ages[idx] = 0
+        self.move_count[idx] = 0
+        self.episode_steps[idx] = 0
+        if self.starting_player is None:
+            self.current_player[idx] = self.rng.choice([X, O], size=len(idx))
+        else:
+            self.current_player[idx] = X if self.starting_player == "X" else O
+
+    def step(self, actions):
+        """Apply one action per game and return (observations, rewards, dones, info).
+
+        info holds per-game arrays: "winner" (1, -1 or 0), "illegal",
+        "truncated" (max_steps reached) and "final_observation".
+        """
+        actions = np.asarray(actions)
+        rows = np.arange(self.num_envs)
+        legal = self.board[rows, actions] == EMPTY
+        rewards = np.where(legal, 0.0, -0.1)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        winner = np.zeros(self.num_envs, dtype=np.int8)
+
+        g = np.flatnonzero(legal)
+        if len(g):
+            rewards[g], dones[g], winner[g] = self._play(g, actions[g])
+
+        self.episode_steps += 1
+        truncated = ~dones & (self.episode_steps >= self.max_steps) if self.max_steps else np.zeros_like(dones)
+        dones |= truncated
+
+        obs = self._get_observation()
+        info = {"winner": winner, "illegal": ~legal, "truncated": truncated, "final_observation": obs.copy()}
+        finished = np.flatnonzero(dones)
+        if len(finished):
+            self._reset_games(finished)
+            obs[finished] = self._get_observation()[finished]
+        return obs, rewards, dones, info
+
+    def _play(self, g, action):
+        """Place a piece in games g, returning their (rewards, dones, winners)."""
+        board = self.board[g]
+        ages = self.ages[g]
+        player = self.current_player[g]
+        cols = np.arange(len(g))
+        self.move_count[g] += 1
+
+        occupied = board != EMPTY
+        ages[occupied] += 1
+        lifespan = np.where(board == X, self.lifespan_x, self.lifespan_o)
+        expired_cells = occupied & (ages >= lifespan)
+        expired = expired_cells.any(axis=1)
+        board[expired_cells] = EMPTY
+        ages[expired_cells] = 0
+        board[cols, action] = player
+        ages[cols, action] = 0
+
+        line_vals = board[:, self.lines]
+        mine = (line_vals == player[:, None, None]).sum(axis=2)
+        theirs = (line_vals == -player[:, None, None]).sum(axis=2)
+        empty = (line_vals == EMPTY).sum(axis=2)
+        won = (mine == self.win_length).any(axis=1)
+
+        need = self.win_length - 1
+        near_win_count = ((mine == need) & (empty == 1)).sum(axis=1)
+        rewards = np.where(near_win_count >= 2, 0.5, np.where(near_win_count == 1, 0.3, 0))
+
+        # Same pre-move board as the scalar env: the first age-0 cell in
+        # row-major order is cleared, which is the new piece only when it
+        # precedes every empty cell.
+        removed = np.argmax(ages == 0, axis=1) == action
+        before_empty = empty + (self.cell_lines[action] & removed[:, None])
+        opponent_before = ((theirs == need) & (before_empty == 1)).sum(axis=1)
+        opponent_after = ((theirs == need) & (empty == 1)).sum(axis=1)
+        rewards = rewards + np.where(opponent_before > opponent_after, 0.3, 0)
+        rewards = rewards - np.where(expired & (near_win_count == 0), 0.05, 0)
+
+        full = ~(board == EMPTY).any(axis=1)
+        rewards = np.where(won, 1, np.where(full, 0.2, rewards))
+        dones = won | full
+
+        self.board[g] = board
+        self.ages[g] = ages
+        self.current_player[g] = np.where(won, player, -player)
+        return rewards, dones, np.where(won, player, 0)
+
+    def _get_observation(self):
+        """Stack per-game observations into a (num_envs, grid, grid, 3) array."""
+        obs = np.empty((self.num_envs, self.n_cells, 3), dtype=np.float32)
+        obs[:, :, 0] = self.board
+        obs[:, :, 1] = self.ages
+        obs[:, :, 2] = self.board
+        return obs.reshape(self.num_envs, self.grid_size, self.grid_size, 3)
+
+    def legal_action_mask(self):
+        """Return a (num_envs, n_cells) boolean mask of legal actions."""
+        return self.board == EMPTY
+
+    def random_actions(self):
+        """Sample one uniformly random legal action per game."""
+        scores = self.rng.random((self.num_envs, self.n_cells))
+        scores[~self.legal_action_mask()] = -1
+        return scores.argmax(axis=1)
@@ -0,0 +1,321 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+from env import EphemeralTicTacToeEnv
+from bitboard_env import BitboardTicTacToeEnv
+from batch_env import BatchEphemeralTicTacToeEnv
+from main import QTablePlayer
+from q_store import DenseQTable
+from replay_buffer import ReplayBuffer
+from symmetry import get_symmetry
+from train import REPLAY_CAPACITY, hash_state, play_episode, train_against_random, update_q_table
+from parallel_train import WORKERS, train_parallel
+
+# Configuration switches
+STEPS = 50000  # Environment steps per measurement
+SEED = 0
+NUM_ENVS = 4096  # Games per batch for the vectorized env
+TRAIN_EPISODES = 5000  # Episodes per training measurement
+GRID_SIZES = (3, 4, 5, 6, 8, 10, 12)  # Board sizes for the scaling benchmark
+SCALING_STEPS = 5000  # Steps per board size in the scaling benchmark
+LATENCY_SAMPLES = 5000  # Calls timed for the per-call latency benchmarks
+REPEATS = 5  # Suite measurements keep the best of this many runs, as timeit does, to damp noise
+UPDATE_EPISODES = 2000  # Episodes replayed through update_q_table
+RESULTS_PATH = "benchmark_results.json"
+REGRESSION_THRESHOLD = 0.10  # Relative change that compare() reports as a regression
+
+
+def bench_env_steps(env_cls, steps=STEPS, seed=SEED, **env_kwargs):
+    """Play random legal moves for `steps` steps and return steps/sec."""
+    rng = random.Random(seed)
+    env = env_cls(seed=seed, **env_kwargs)
+    env.reset(starting_player="X")
+    start = time.perf_counter()
+    for _ in range(steps):
+        action = rng.choice(env.get_legal_actions())
+        _, _, done, _ = env.step(action)
+        if done:
+            env.reset(starting_player="X")
+    return steps / (time.perf_counter() - start)
+
+
+def bench_batch_env_steps(num_envs=NUM_ENVS, steps=STEPS, seed=SEED, **env_kwargs):
+    """Step a batch of random-move games and return total game steps/sec."""
+    env = BatchEphemeralTicTacToeEnv(num_envs, seed=seed, **env_kwargs)
+    env.reset(starting_player="X")
+    batches = max(1, steps // num_envs)
+    start = time.perf_counter()
+    for _ in range(batches):
+        env.step(env.random_actions())
+    return batches * num_envs / (time.perf_counter() - start)
+
+
+def compare_envs(steps=STEPS, seed=SEED):
+    """Compare the scalar, bitboard and batched envs on the default config."""
+    baseline = bench_env_steps(EphemeralTicTacToeEnv, steps, seed)
+    bitboard = bench_env_steps(BitboardTicTacToeEnv, steps, seed)
+    print(f"EphemeralTicTacToeEnv: {baseline:,.0f} steps/sec")
+    print(f"BitboardTicTacToeEnv:  {bitboard:,.0f} steps/sec ({bitboard / baseline:.1f}x)")
+    batch = bench_batch_env_steps(steps=steps * 10, seed=seed)
+    print(f"BatchEphemeralTicTacToeEnv ({NUM_ENVS} games): {batch:,.0f} steps/sec ({batch / baseline:.1f}x)")
+
+
+def compare_grid_sizes(grid_sizes=GRID_SIZES, steps=SCALING_STEPS, seed=SEED):
+    """Steps/sec of each env as the board grows; boards from 5x5 up need 4 in a row, from 8x8 up 5."""
+    print(f"{'N':>3} {'k':>2} {'scalar':>10} {'bitboard':>10} {'batch':>12}")
+    for n in grid_sizes:
+        k = 3 if n < 5 else 4 if n < 8 else 5
+        scalar = bench_env_steps(EphemeralTicTacToeEnv, steps, seed, grid_size=n, win_length=k)
+        bitboard = bench_env_steps(BitboardTicTacToeEnv, steps, seed, grid_size=n, win_length=k)
+        batch = bench_batch_env_steps(steps=steps * 20, seed=seed, grid_size=n, win_length=k)
+        print(f"{n:>3} {k:>2} {scalar:>10,.0f} {bitboard:>10,.0f} {batch:>12,.0f}")
+
+
+def bench_training(episodes=TRAIN_EPISODES, workers=None, seed=SEED):
+    """Return training episodes/sec: serial loop if workers is None, else train_parallel."""
+    random.seed(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        q_table_path = os.path.join(tmp, "q_table.qtab")
+        start = time.perf_counter()
+        if workers is None:
+            train_against_random(episodes, gui=False, checkpoint_every=None, q_table_path=q_table_path)
+        else:
+            train_parallel(episodes, workers, seed=seed, checkpoint_every=None, q_table_path=q_table_path)
+        return episodes / (time.perf_counter() - start)
+
+
+def compare_training(episodes=TRAIN_EPISODES, seed=SEED):
+    """Compare the serial training loop with parallel training on WORKERS processes."""
+    serial = bench_training(episodes, seed=seed)
+    parallel = bench_training(episodes, WORKERS, seed=seed)
+    print(f"train_against_random: {serial:,.0f} episodes/sec")
+    print(f"train_parallel ({WORKERS} workers): {parallel:,.0f} episodes/sec ({parallel / serial:.1f}x)")
+
+
+def _quiet(fn, *args, **kwargs):
+    """Call fn with its progress output suppressed."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def _random_observations(samples, seed):
+    """Observations of X-to-move states from seeded random games."""
+    rng = random.Random(seed)
+    env = EphemeralTicTacToeEnv(seed=seed)
+    obs = env.reset(starting_player="X")
+    states = []
+    while len(states) < samples:
+        if env.current_player == "X":
+            states.append(obs.copy())
+        obs, _, done, _ = env.step(rng.choice(env.get_legal_actions()))
+        if done:
+            obs = env.reset(starting_player="X")
+    return states
+
+
+def bench_hash_state(samples=LATENCY_SAMPLES, seed=SEED, repeats=REPEATS):
+    """Mean microseconds per hash_state call on observations from random games (best of repeats)."""
+    observations = _random_observations(samples, seed)
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for obs in observations:
+            hash_state(obs)
+        best = min(best, time.perf_counter() - start)
+    return best / len(observations) * 1e6
+
+
+def bench_set_state(env_cls, samples=LATENCY_SAMPLES, seed=SEED, repeats=REPEATS):
+    """Mean microseconds per set_state call on the get_state() values of seeded random games (best of repeats)."""
+    rng = random.Random(seed)
+    env = env_cls(seed=seed)
+    env.reset(starting_player="X")
+    states = []
+    while len(states) < samples:
+        states.append(env.get_state())
+        _, _, done, _ = env.step(rng.choice(env.get_legal_actions()))
+        if done:
+            env.reset(starting_player="X")
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for state in states:
+            env.set_state(state)
+        best = min(best, time.perf_counter() - start)
+    return best / len(states) * 1e6
+
+
+def bench_select_action(q_table, samples=LATENCY_SAMPLES, seed=SEED, repeats=REPEATS):
+    """(p50, p99) microseconds per QTablePlayer.select_action call over the states of seeded random games.
+
+    The same states are replayed `repeats` times and each call keeps its
+    fastest time, so the percentiles describe the code rather than
+    scheduler hiccups.
+    """
+    player = QTablePlayer()
+    timings = np.full(samples, np.inf)
+    for _ in range(repeats):
+        rng = random.Random(seed)
+        env = EphemeralTicTacToeEnv(seed=seed)
+        obs = env.reset(starting_player="X")
+        for i in range(samples):
+            start = time.perf_counter()
+            player.select_action(env, obs, q_table)
+            timings[i] = min(timings[i], time.perf_counter() - start)
+            obs, _, done, _ = env.step(rng.choice(env.get_legal_actions()))
+            if done:
+                obs = env.reset(starting_player="X")
+    p50, p99 = np.percentile(timings, [50, 99]) * 1e6
+    return float(p50), float(p99)
+
+
+def bench_update_q_table(episodes=UPDATE_EPISODES, seed=SEED, repeats=REPEATS):
+    """Transitions/sec through update_q_table, replaying seeded random episodes into a fresh table (best of repeats)."""
+    random.seed(seed)
+    env = BitboardTicTacToeEnv(seed=seed)
+    buffer = ReplayBuffer(REPLAY_CAPACITY)
+    histories = [play_episode(env, DenseQTable(), 1.0, buffer)[0] for _ in range(episodes)]
+    symmetry = get_symmetry()
+    best = float("inf")
+    for _ in range(repeats):
+        q_table = DenseQTable()
+        start = time.perf_counter()
+        for history in histories:
+            update_q_table(history, q_table, symmetry=symmetry)
+        best = min(best, time.perf_counter() - start)
+    return sum(len(h.states) for h in histories) / best
+
+
+def bench_q_table_storage(q_table, repeats=20):
+    """States, in-memory bytes, file bytes and median open time (ms) of a Q-table saved as .qtab."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "q_table.qtab")
+        q_table.save(path)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            DenseQTable.open(path)
+            timings.append(time.perf_counter() - start)
+        file_bytes = os.path.getsize(path)
+    return len(q_table), q_table.nbytes(), file_bytes, float(np.median(timings)) * 1e3
+
+
+def run_suite(seed=SEED, quick=False):
+    """Run every benchmark on seeded workloads and return a JSON-ready results dict.
+
+    Each metric records its value, unit and whether higher is better (None
+    for sizes that are reported but never counted as regressions).
+    """
+    scale = 10 if quick else 1
+    metrics = {}
+
+    def record(name, value, unit, higher_is_better):
+        metrics[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+    def best(bench, *args, **kwargs):
+        return max(bench(*args, **kwargs) for _ in range(REPEATS))
+
+    record("env_step", best(bench_env_steps, EphemeralTicTacToeEnv, STEPS // scale, seed), "steps/s", True)
+    record("bitboard_env_step", best(bench_env_steps, BitboardTicTacToeEnv, STEPS // scale, seed), "steps/s", True)
+    record("batch_env_step", best(bench_batch_env_steps, steps=STEPS * 10 // scale, seed=seed), "steps/s", True)
+    record("hash_state", bench_hash_state(LATENCY_SAMPLES // scale, seed), "us", False)
+    record("env_set_state", bench_set_state(EphemeralTicTacToeEnv, LATENCY_SAMPLES // scale, seed), "us", False)
+    record("bitboard_env_set_state", bench_set_state(BitboardTicTacToeEnv, LATENCY_SAMPLES // scale, seed), "us", False)
+
+    fastest = float("inf")
+    for _ in range(REPEATS):
+        with tempfile.TemporaryDirectory() as tmp:
+            random.seed(seed)
+            np.random.seed(seed)
+            start = time.perf_counter()
+            q_table = _quiet(train_against_random, TRAIN_EPISODES // scale, gui=False, checkpoint_every=None,
+                             q_table_path=os.path.join(tmp, "q_table.qtab"))
+            fastest = min(fastest, time.perf_counter() - start)
+    record("train_against_random", TRAIN_EPISODES // scale / fastest, "episodes/s", True)
+
+    p50, p99 = bench_select_action(q_table, LATENCY_SAMPLES // scale, seed)
+    record("select_action_p50", p50, "us", False)
+    record("select_action_p99", p99, "us", False)
+    record("update_q_table", bench_update_q_table(UPDATE_EPISODES // scale, seed), "transitions/s", True)
+
+    states, memory, file_bytes, open_ms = bench_q_table_storage(q_table)
+    record("q_table_states", states, "states", None)
+    record("q_table_memory", memory, "bytes", False)
+    record("q_table_file", file_bytes, "bytes", False)
+    record("q_table_open", open_ms, "ms", False)
+
+    return {
+        "meta": {"seed": seed, "quick": quick, "python": platform.python_version(), "numpy": np.__version__,
+                 "platform": platform.platform(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "metrics": metrics,
+    }
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Print the change of every baseline metric; return the names that regressed or are missing from current."""
+    regressions = []
+    for name, old in baseline["metrics"].items():
+        new = current["metrics"].get(name)
+        if new is None:  # A benchmark that crashed or was renamed must not pass silently
+            regressions.append(name)
+            print(f"{name:<22} {old['value']:>14,.2f} -> {'missing':>14} {old['unit']:<14}  MISSING")
+            continue
+        change = (new["value"] - old["value"]) / old["value"] if old["value"] else 0.0
+        better = old["higher_is_better"]
+        worse = better is not None and (change < -threshold if better else change > threshold)
+        if worse:
+            regressions.append(name)
+        print(f"{name:<22} {old['value']:>14,.2f} -> {new['value']:>14,.2f} {new['unit']:<14} "
+              f"{change:+7.1%}{'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ephemeral Tic-Tac-Toe benchmarks")
+    commands = parser.add_subparsers(dest="command")
+    run = commands.add_parser("run", help="run the benchmark suite and write JSON results")
+    run.add_argument("-o", "--output", default=RESULTS_PATH)
+    run.add_argument("--seed", type=int, default=SEED)
+    run.add_argument("--quick", action="store_true", help="10x smaller workloads")
+    check = commands.add_parser("compare", help="compare two result files, exit 1 on regressions")
+    check.add_argument("baseline")
+    check.add_argument("current")
+    check.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    commands.add_parser("envs", help="print env, board size and training comparisons")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run_suite(args.seed, args.quick)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        for name, metric in results["metrics"].items():
+            print(f"{name:<22} {metric['value']:>14,.2f} {metric['unit']}")
+        print(f"Results written to {args.output}")
+    elif args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) past {args.threshold:.0%} or missing metric(s): "
+                  f"{', '.join(regressions)}")
+            return 1
+        print(f"No regressions past {args.threshold:.0%}")
+    else:
+        compare_envs()
+        compare_grid_sizes()
+        compare_training()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
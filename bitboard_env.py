@@ -0,0 +1,299 @@
+import copy
+from functools import lru_cache
+import numpy as np
+from env import build_lines
+from state_keys import get_encoder
+
+if hasattr(int, "bit_count"):
+    _popcount = int.bit_count
+else:
+    def _popcount(x):
+        return bin(x).count("1")
+
+
+def build_line_masks(grid_size, win_length=3):
+    """Return a bitmask for every winning line of win_length cells (see env.build_lines)."""
+    return [sum(1 << c for c in line) for line in build_lines(grid_size, win_length).tolist()]
+
+
+@lru_cache(maxsize=1 << 15)
+def _layout(encoder, key):
+    """What set_state() derives from a state key alone, cached because search restores the same states often.
+
+    Returns (X bits, O bits, X queue, O queue, (cell, age) pairs, obs base,
+    obs occupied, occupied powers); the obs base holds ages where the env
+    keeps -birth, so subtracting move_count times the occupied array gives
+    the env's _obs_base. The arrays are shared and must not be written to.
+    """
+    owners, ages = encoder.decode(key)
+    bits = {"X": 0, "O": 0}
+    obs_base = np.zeros((encoder.n_cells, 3), dtype=np.float32)
+    obs_occupied = np.zeros((encoder.n_cells, 3), dtype=np.float32)
+    occupied_powers = 0
+    pieces = []
+    for cell, (owner, age) in enumerate(zip(owners, ages)):
+        if owner is not None:
+            bits[owner] |= 1 << cell
+            sign = 1 if owner == "X" else -1
+            obs_base[cell] = (sign, age, sign)
+            obs_occupied[cell, 1] = 1
+            occupied_powers += encoder.powers[cell]
+            pieces.append((-age, cell, owner))
+    pieces.sort()  # Oldest first, the order in which they expire
+    obs_base.flags.writeable = obs_occupied.flags.writeable = False
+    return (bits["X"], bits["O"], tuple(cell for _, cell, owner in pieces if owner == "X"),
+            tuple(cell for _, cell, owner in pieces if owner == "O"), tuple((cell, -age) for age, cell, _ in pieces),
+            obs_base, obs_occupied, occupied_powers)
+
+
+class BitboardTicTacToeEnv:
+    """Ephemeral Tic-Tac-Toe engine that keeps the board as a pair of bitboards.
+
+    Produces the same observations, rewards and info as EphemeralTicTacToeEnv.
+    Ages are not stored per cell: each piece remembers the move on which it was
+    placed, and since all pieces of one player share a lifespan they expire in
+    placement order, so expiry only has to look at the head of a queue.
+    The observation buffer options, step_key(), clone(), restore(),
+    get_state(), set_state() and seeding work as in EphemeralTicTacToeEnv.
+    """
+
+    def __init__(self, grid_size=3, lifespan_x=6, lifespan_o=6, win_length=3, reuse_observation=False, seed=None):
+        self.grid_size = grid_size
+        self.lifespan_x = lifespan_x
+        self.lifespan_o = lifespan_o
+        self.win_length = win_length
+        self.n_cells = grid_size * grid_size
+        self.full_mask = (1 << self.n_cells) - 1
+        self.line_masks = build_line_masks(grid_size, win_length)
+        self.cell_lines = [[m for m in self.line_masks if m >> c & 1] for c in range(self.n_cells)]
+        self.encoder = get_encoder(grid_size, lifespan_x, lifespan_o)
+        self.bits = {"X": 0, "O": 0}
+        self.birth = [0] * self.n_cells
+        self.queues = {"X": [], "O": []}
+        # Observation rows are (sign, -birth, sign) for occupied cells; adding
+        # move_count on the age column of occupied cells yields the ages.
+        self._obs_base = np.zeros((self.n_cells, 3), dtype=np.float32)
+        self._obs_occupied = np.zeros((self.n_cells, 3), dtype=np.float32)
+        self.reuse_observation = reuse_observation
+        self._obs = np.zeros((grid_size, grid_size, 3), dtype=np.float32)
+        self._key = 0
+        self._occupied_powers = 0  # Sum of encoder powers over occupied cells: what one round of aging adds to the key
+        self.rng = np.random.default_rng(seed)
+        self.current_player = None
+        self.move_count = 0
+
+    def reset(self, starting_player=None, seed=None):
+        """Reset the environment and return the initial observation.
+
+        Without starting_player the env's generator picks one; pass seed to
+        reseed it first.
+        """
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self.bits = {"X": 0, "O": 0}
+        self.birth = [0] * self.n_cells
+        self.queues = {"X": [], "O": []}
+        self._obs_base.fill(0)
+        self._obs_occupied.fill(0)
+        self._key = self._occupied_powers = 0
+        self.current_player = ("X", "O")[self.rng.integers(2)] if starting_player is None else starting_player
+        self.move_count = 0
+        return self._get_observation()
+
+    def get_state(self):
+        """The game state as a hashable (state key, player to move, move count) tuple, as in EphemeralTicTacToeEnv."""
+        return self._key, self.current_player, self.move_count
+
+    def set_state(self, state):
+        """Put the env in the state returned by either env's get_state()."""
+        key, player, move_count = state
+        bits_x, bits_o, queue_x, queue_o, pieces, obs_base, obs_occupied, occupied_powers = _layout(self.encoder, key)
+        birth = self.birth
+        for cell, age in pieces:
+            birth[cell] = move_count - age
+        np.multiply(obs_occupied, move_count, out=self._obs_base)
+        np.subtract(obs_base, self._obs_base, out=self._obs_base)
+        self._obs_occupied[...] = obs_occupied
+        self.queues = {"X": list(queue_x), "O": list(queue_o)}
+        self.bits = {"X": bits_x, "O": bits_o}
+        self._key = key
+        self._occupied_powers = occupied_powers
+        self.current_player = player
+        self.move_count = move_count
+
+    def clone(self):
+        """Independent copy of the env: game state is copied, line masks and lookup tables are shared.
+
+        The random generator is shared too; reset the copy with a seed for a stream of its own.
+        """
+        env = copy.copy(self)
+        env.bits = dict(self.bits)
+        env.birth = self.birth[:]
+        env.queues = {player: queue[:] for player, queue in self.queues.items()}
+        env._obs_base = self._obs_base.copy()
+        env._obs_occupied = self._obs_occupied.copy()
+        env._obs = self._obs.copy()
+        return env
+
+    def restore(self, source):
+        """Copy the game state of source (a clone of this env, e.g. taken before a lookahead) into this env."""
+        self.bits = dict(source.bits)
+        self.birth[:] = source.birth
+        self.queues = {player: queue[:] for player, queue in source.queues.items()}
+        self._obs_base[...] = source._obs_base
+        self._obs_occupied[...] = source._obs_occupied
+        self._key = source._key
+        self._occupied_powers = source._occupied_powers
+        self.current_player = source.current_player
+        self.move_count = source.move_count
+
+    def step(self, action):
+        """Take an action and return (observation, reward, done, info)."""
+        reward, done, info = self._play(action)
+        return self._get_observation(), reward, done, info
+
+    def step_key(self, action):
+        """Take an action and return (state key, reward, done, info) without building an observation."""
+        reward, done, info = self._play(action)
+        return self._key, reward, done, info
+
+    def _play(self, action):
+        """Apply an action to the internal state and return (reward, done, info)."""
+        bit = 1 << action
+        bits = self.bits
+        if (bits["X"] | bits["O"]) & bit:
+            return -0.1, False, {"reason": "illegal move"}
+
+        self.move_count += 1
+        self._key += self._occupied_powers
+        expired = self._expire_pieces()
+        player = self.current_player
+        opponent = "O" if player == "X" else "X"
+        bits[player] |= bit
+        self.birth[action] = self.move_count
+        self.queues[player].append(action)
+        sign = 1 if player == "X" else -1
+        self._obs_base[action] = (sign, -self.move_count, sign)
+        self._obs_occupied[action, 1] = 1
+        power = self.encoder.powers[action]
+        self._key += self.encoder.cell_digit(player, 0) * power
+        self._occupied_powers += power
+
+        mine = bits[player]
+        for mask in self.cell_lines[action]:
+            if mine & mask == mask:
+                return 1, True, {"player": player}
+
+        empty = self.full_mask & ~(mine | bits[opponent])
+        reward = 0
+        near_win_count = self._count_near_wins(mine, empty)
+        if near_win_count >= 2:
+            reward += 0.5
+        elif near_win_count == 1:
+            reward += 0.3
+
+        if self._blocked_near_win(bits[opponent], empty, bit):
+            reward += 0.3
+
+        if expired and near_win_count == 0:
+            reward -= 0.05
+
+        self.current_player = opponent
+        if not empty:
+            return 0.2, True, {}
+
+        return reward, False, {"player": self.current_player}
+
+    def _expire_pieces(self):
+        """Remove pieces that reached their lifespan, return True if any expired."""
+        expired = False
+        for player, lifespan in (("X", self.lifespan_x), ("O", self.lifespan_o)):
+            queue = self.queues[player]
+            while queue and self.move_count - self.birth[queue[0]] >= lifespan:
+                cell = queue.pop(0)
+                power = self.encoder.powers[cell]
+                self._key -= self.encoder.cell_digit(player, self.move_count - self.birth[cell]) * power
+                self._occupied_powers -= power
+                self.bits[player] &= ~(1 << cell)
+                self._obs_base[cell] = 0
+                self._obs_occupied[cell, 1] = 0
+                expired = True
+        return expired
+
+    def _count_near_wins(self, mine, empty):
+        """Count lines one piece short of a win whose remaining cell is empty."""
+        need = self.win_length - 1
+        count = 0
+        for mask in self.line_masks:
+            if _popcount(mine & mask) == need and _popcount(empty & mask) == 1:
+                count += 1
+        return count
+
+    def _blocked_near_win(self, theirs, empty, bit):
+        """Return True if the new piece at `bit` took away opponent near-wins.
+
+        The scalar env rebuilds the pre-move board by clearing the first cell
+        with age 0 in row-major order. Empty cells also have age 0, so the new
+        piece is only removed when it comes before every empty cell; otherwise
+        the "before" board equals the current one and nothing was blocked.
+        """
+        if empty & (bit - 1):
+            return False
+        before_empty = empty | bit
+        need = self.win_length - 1
+        delta = 0
+        for mask in self.cell_lines[bit.bit_length() - 1]:
+            if _popcount(theirs & mask) == need:
+                delta += (_popcount(before_empty & mask) == 1) - (_popcount(empty & mask) == 1)
+        return delta > 0
+
+    def observe(self, out=None):
+        """Write the observation into out (a float32 (grid, grid, 3) array) or a new array, and return it."""
+        if out is None:
+            out = np.empty((self.grid_size, self.grid_size, 3), dtype=np.float32)
+        flat = out.reshape(self.n_cells, 3)
+        np.multiply(self._obs_occupied, self.move_count, out=flat)
+        flat += self._obs_base
+        return out
+
+    def _get_observation(self):
+        """Convert game state to a numerical observation."""
+        return self.observe(self._obs if self.reuse_observation else None)
+
+    def get_legal_actions(self):
+        """Return a list of legal action indices."""
+        occupied = self.bits["X"] | self.bits["O"]
+        return [c for c in range(self.n_cells) if not occupied >> c & 1]
+
+    def legal_action_mask(self, out=None):
+        """Boolean array over cells, True where a move is legal."""
+        return np.equal(self._obs_occupied[:, 1], 0, out=out)
+
+    def legal_bitmask(self):
+        """Legal moves as an int with bit c set when cell c is empty."""
+        return self.full_mask & ~(self.bits["X"] | self.bits["O"])
+
+    def state_key(self):
+        """Integer key of the current state, equal to hash_state of the observation."""
+        return self._key
+
+    @property
+    def board(self):
+        """Object array of "X"/"O"/None, matching EphemeralTicTacToeEnv.board."""
+        board = np.full((self.grid_size, self.grid_size), None, dtype=object)
+        flat = board.reshape(-1)
+        for player in ("X", "O"):
+            for c in self.queues[player]:
+                flat[c] = player
+        return board
+
+    owners = board
+
+    @property
+    def ages(self):
+        """Integer array of piece ages, matching EphemeralTicTacToeEnv.ages."""
+        ages = np.zeros(self.n_cells, dtype=int)
+        for player in ("X", "O"):
+            for c in self.queues[player]:
+                ages[c] = self.move_count - self.birth[c]
+        return ages.reshape(self.grid_size, self.grid_size)
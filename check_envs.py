@@ -0,0 +1,113 @@
+import argparse
+import random
+import sys
+from env import EphemeralTicTacToeEnv
+from bitboard_env import BitboardTicTacToeEnv
+from batch_env import BatchEphemeralTicTacToeEnv
+
+# Configuration switches
+SEED = 0
+GAMES = 32  # Games played side by side per configuration
+MOVES = 100  # Moves per game slot; finished games restart, so a slot plays several games
+ILLEGAL_RATE = 0.1  # Share of moves aimed at any cell, occupied ones included, to cover illegal moves
+CONFIGS = (  # (grid_size, win_length, lifespan_x, lifespan_o)
+    (3, 3, 6, 6),
+    (3, 3, 3, 4),
+    (3, 2, 6, 6),
+    (4, 3, 6, 6),
+    (4, 4, 8, 5),
+    (5, 4, 7, 9),
+    (6, 5, 12, 12),
+    (7, 2, 3, 3),
+)
+
+
+def expect(condition, what, *context):
+    if not condition:
+        raise AssertionError(f"{what} differs ({', '.join(map(str, context))})")
+
+
+def check_config(grid_size, win_length, lifespan_x, lifespan_o, games=GAMES, moves=MOVES, seed=SEED):
+    """Play seeded random games on every engine in lockstep; raise AssertionError at the first difference.
+
+    EphemeralTicTacToeEnv is the reference. The same moves go to a
+    BitboardTicTacToeEnv per game, to one BatchEphemeralTicTacToeEnv holding
+    all games (it recounts every line from scratch, so it also checks the
+    scalar env's incremental line counts), and to clones and to envs of both
+    kinds rewound with set_state() to the reference's get_state().
+    Observations, rewards, dones, winners, state keys and legal moves must
+    all agree. Returns the number of moves checked.
+    """
+    config = (grid_size, lifespan_x, lifespan_o, win_length)
+    rng = random.Random(seed)
+    checked = 0
+    for starting_player in ("X", "O"):
+        refs = [EphemeralTicTacToeEnv(*config) for _ in range(games)]
+        bits = [BitboardTicTacToeEnv(*config) for _ in range(games)]
+        batch = BatchEphemeralTicTacToeEnv(games, grid_size, lifespan_x, lifespan_o, seed=seed, win_length=win_length)
+        spares = [EphemeralTicTacToeEnv(*config), BitboardTicTacToeEnv(*config)]
+        encoder = refs[0].encoder
+        batch_obs = batch.reset(starting_player)
+        for i, (ref, bit) in enumerate(zip(refs, bits)):
+            obs = ref.reset(starting_player)
+            expect((bit.reset(starting_player) == obs).all(), "bitboard reset observation", config, i)
+            expect((batch_obs[i] == obs).all(), "batch reset observation", config, i)
+
+        for move in range(moves):
+            actions = []
+            for ref in refs:
+                legal = ref.get_legal_actions()
+                actions.append(rng.randrange(ref.n_cells) if rng.random() < ILLEGAL_RATE else rng.choice(legal))
+            _, batch_rewards, batch_dones, batch_info = batch.step(actions)
+
+            for i, (ref, bit, action) in enumerate(zip(refs, bits, actions)):
+                context = (config, starting_player, f"game {i}", f"move {move}", f"action {action}")
+                state = ref.get_state()
+                expect(bit.get_state() == state, "get_state", *context)
+                clone = ref.clone()
+                spare = spares[move % 2]
+                spare.set_state(state)
+
+                obs, reward, done, info = ref.step(action)
+                key = ref.state_key()
+                expect(key == encoder.from_observation(obs), "state key", *context)
+                for name, env in (("bitboard", bit), ("clone", clone), ("set_state", spare)):
+                    other_obs, other_reward, other_done, other_info = env.step(action)
+                    expect((other_obs == obs).all(), f"{name} observation", *context)
+                    expect((other_reward, other_done, other_info) == (reward, done, info), f"{name} result", *context)
+                    expect(env.state_key() == key, f"{name} state key", *context)
+                    expect(env.get_legal_actions() == ref.get_legal_actions(), f"{name} legal moves", *context)
+                    expect(env.legal_bitmask() == ref.legal_bitmask(), f"{name} legal bitmask", *context)
+
+                expect((batch_info["final_observation"][i] == obs).all(), "batch observation", *context)
+                expect((batch_rewards[i], batch_dones[i]) == (reward, done), "batch result", *context)
+                expect(batch_info["illegal"][i] == ("reason" in info), "batch illegal flag", *context)
+                winner = {"X": 1, "O": -1}[info["player"]] if reward == 1 else 0
+                expect(batch_info["winner"][i] == winner, "batch winner", *context)
+                if done:  # The batch env has already restarted this game
+                    ref.reset(starting_player)
+                    bit.reset(starting_player)
+                checked += 1
+    return checked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that the Ephemeral Tic-Tac-Toe engines play identically")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--games", type=int, default=GAMES)
+    parser.add_argument("--moves", type=int, default=MOVES)
+    args = parser.parse_args(argv)
+
+    for grid_size, win_length, lifespan_x, lifespan_o in CONFIGS:
+        label = f"{grid_size}x{grid_size}, {win_length} in a row, lifespans {lifespan_x}/{lifespan_o}"
+        try:
+            checked = check_config(grid_size, win_length, lifespan_x, lifespan_o, args.games, args.moves, args.seed)
+        except AssertionError as error:
+            print(f"{label}: FAILED, {error}")
+            return 1
+        print(f"{label}: {checked:,} moves match")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,42 +1,191 @@
+import copy
 import numpy as np
+from state_keys import get_encoder
+
+def build_lines(grid_size, win_length=3):
+    """Return every run of win_length cells (rows, columns, both diagonals) as flat cell indices."""
+    if not 1 <= win_length <= grid_size:
+        raise ValueError(f"win_length must be between 1 and grid_size ({grid_size}), got {win_length}")
+    lines = []
+    for r in range(grid_size):
+        for c in range(grid_size):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                end_r, end_c = r + dr * (win_length - 1), c + dc * (win_length - 1)
+                if 0 <= end_r < grid_size and 0 <= end_c < grid_size:
+                    lines.append([(r + dr * i) * grid_size + c + dc * i for i in range(win_length)])
+    return np.array(lines, dtype=np.int64).reshape(-1, win_length)
 
 class EphemeralTicTacToeEnv:
-    """Environment for Ephemeral Tic-Tac-Toe with expiring pieces."""
+    """Environment for Ephemeral Tic-Tac-Toe with expiring pieces.
+
+    The board is grid_size x grid_size and a player wins with win_length of
+    their pieces in a row, column or diagonal. Each player's piece count per
+    line is updated as pieces are placed and expire, along with running
+    totals of won and near-won lines, so win and near-win queries never
+    rescan the board.
+
+    Observations are built from a per-cell sign array with a few vectorized
+    copies. With reuse_observation set, reset() and step() write them into
+    one internal buffer that is overwritten on the next call; observe(out)
+    fills a caller-supplied buffer, and step_key() skips the observation and
+    returns the state key, which is kept up to date move by move. clone()
+    and restore() copy the game state without the shared lookup tables, for
+    lookahead search; get_state() and set_state() capture it as a small
+    hashable value instead. The random starting player comes from the env's
+    own generator, seeded with seed.
+    """
 
-    def __init__(self, grid_size=3, lifespan_x=6, lifespan_o=6):
+    def __init__(self, grid_size=3, lifespan_x=6, lifespan_o=6, win_length=3, reuse_observation=False, seed=None):
         self.grid_size = grid_size
         self.lifespan_x = lifespan_x
         self.lifespan_o = lifespan_o
+        self.win_length = win_length
+        self.n_cells = grid_size * grid_size
+        self.lines = build_lines(grid_size, win_length)
+        self.cell_lines = [[] for _ in range(self.n_cells)]
+        for line, cells in enumerate(self.lines.tolist()):
+            for c in cells:
+                self.cell_lines[c].append(line)
+        self.line_counts = {"X": [0] * len(self.lines), "O": [0] * len(self.lines)}
+        self.wins = {"X": 0, "O": 0}  # Lines filled by each player
+        self.near_wins = {"X": 0, "O": 0}  # Lines one piece short of a win, with the last cell empty
+        self.occupied = bytearray(self.n_cells)
+        self.occupied_bits = 0
+        self.empty_count = self.n_cells
+        self.last_cell = None
         self.board = np.full((grid_size, grid_size), None, dtype=object)
         self.ages = np.zeros((grid_size, grid_size), dtype=int)
         self.owners = np.full((grid_size, grid_size), None, dtype=object)
+        self.signs = np.zeros(self.n_cells, dtype=np.int8)  # 1 = X, -1 = O, 0 = empty
+        self.encoder = get_encoder(grid_size, lifespan_x, lifespan_o)
+        self.reuse_observation = reuse_observation
+        self._obs = np.zeros((grid_size, grid_size, 3), dtype=np.float32)
+        self._key = 0
+        self._occupied_powers = 0  # Sum of encoder powers over occupied cells: what one round of aging adds to the key
+        self.rng = np.random.default_rng(seed)
         self.current_player = None
         self.move_count = 0
 
-    def reset(self, starting_player=None):
-        """Reset the environment and return the initial observation."""
+    def reset(self, starting_player=None, seed=None):
+        """Reset the environment and return the initial observation.
+
+        Without starting_player the env's generator picks one; pass seed to
+        reseed it first.
+        """
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self._clear()
+        self.current_player = ("X", "O")[self.rng.integers(2)] if starting_player is None else starting_player
+        return self._get_observation()
+
+    def _clear(self):
+        """Empty the board and zero the move count."""
         self.board.fill(None)
         self.ages.fill(0)
         self.owners.fill(None)
-        self.current_player = np.random.choice(["X", "O"]) if starting_player is None else starting_player
+        for player in ("X", "O"):
+            self.line_counts[player] = [0] * len(self.lines)
+            self.wins[player] = self.near_wins[player] = 0
+        self.occupied = bytearray(self.n_cells)
+        self.occupied_bits = 0
+        self.empty_count = self.n_cells
+        self.last_cell = None
+        self.signs.fill(0)
+        self._key = self._occupied_powers = 0
         self.move_count = 0
-        return self._get_observation()
+
+    def get_state(self):
+        """The game state as a hashable (state key, player to move, move count) tuple.
+
+        Both envs return the same value for the same game, and either one's
+        set_state() accepts it.
+        """
+        return self._key, self.current_player, self.move_count
+
+    def set_state(self, state):
+        """Put the env in the state returned by get_state()."""
+        key, player, move_count = state
+        self._clear()
+        owners, ages = self.encoder.decode(key)
+        for cell, (owner, age) in enumerate(zip(owners, ages)):
+            if owner is not None:
+                self.board.flat[cell] = self.owners.flat[cell] = owner
+                self.ages.flat[cell] = age
+                self.signs[cell] = 1 if owner == "X" else -1
+                self._update_lines(cell, owner, 1)
+                self._occupied_powers += self.encoder.powers[cell]
+        self._key = key
+        self.current_player = player
+        self.move_count = move_count
+
+    def clone(self):
+        """Independent copy of the env: game state is copied, board geometry and lookup tables are shared.
+
+        The random generator is shared too; reset the copy with a seed for a stream of its own.
+        """
+        env = copy.copy(self)
+        env.board = self.board.copy()
+        env.ages = self.ages.copy()
+        env.owners = self.owners.copy()
+        env.signs = self.signs.copy()
+        env.line_counts = {player: counts[:] for player, counts in self.line_counts.items()}
+        env.wins = dict(self.wins)
+        env.near_wins = dict(self.near_wins)
+        env.occupied = self.occupied[:]
+        env._obs = self._obs.copy()
+        return env
+
+    def restore(self, source):
+        """Copy the game state of source (a clone of this env, e.g. taken before a lookahead) into this env."""
+        self.board[...] = source.board
+        self.ages[...] = source.ages
+        self.owners[...] = source.owners
+        self.signs[:] = source.signs
+        for player in ("X", "O"):
+            self.line_counts[player][:] = source.line_counts[player]
+            self.wins[player] = source.wins[player]
+            self.near_wins[player] = source.near_wins[player]
+        self.occupied[:] = source.occupied
+        self.occupied_bits = source.occupied_bits
+        self.empty_count = source.empty_count
+        self.last_cell = source.last_cell
+        self._key = source._key
+        self._occupied_powers = source._occupied_powers
+        self.current_player = source.current_player
+        self.move_count = source.move_count
 
     def step(self, action):
         """Take an action and return (observation, reward, done, info)."""
+        reward, done, info = self._play(action)
+        return self._get_observation(), reward, done, info
+
+    def step_key(self, action):
+        """Take an action and return (state key, reward, done, info) without building an observation."""
+        reward, done, info = self._play(action)
+        return self._key, reward, done, info
+
+    def _play(self, action):
+        """Apply an action to the internal state and return (reward, done, info)."""
         row, col = divmod(action, self.grid_size)
-        if self.board[row, col] is not None:
-            return self._get_observation(), -0.1, False, {"reason": "illegal move"}
+        if self.occupied[action]:
+            return -0.1, False, {"reason": "illegal move"}
 
         self.move_count += 1
         self._update_ages()
         expired = self._expire_pieces()
-        self.board[row, col] = self.current_player
+        player = self.current_player
+        self.board[row, col] = player
         self.ages[row, col] = 0
-        self.owners[row, col] = self.current_player
+        self.owners[row, col] = player
+        self._update_lines(action, player, 1)
+        self.signs[action] = 1 if player == "X" else -1
+        power = self.encoder.powers[action]
+        self._key += self.encoder.cell_digit(player, 0) * power
+        self._occupied_powers += power
+        self.last_cell = action
 
         if self._check_win(self.current_player):
-            return self._get_observation(), 1, True, {"player": self.current_player}
+            return 1, True, {"player": self.current_player}
 
         reward = 0
         near_win_count = self._count_near_wins(self.current_player)
@@ -55,84 +204,112 @@ class EphemeralTicTacToeEnv:
             reward -= 0.05
 
         self.current_player = opponent
-        if not self.get_legal_actions():
-            return self._get_observation(), 0.2, True, {}
+        if not self.empty_count:
+            return 0.2, True, {}
+
+        return reward, False, {"player": self.current_player}
 
-        return self._get_observation(), reward, False, {"player": self.current_player}
+    def observe(self, out=None):
+        """Write the observation into out (a float32 (grid, grid, 3) array) or a new array, and return it."""
+        if out is None:
+            out = np.empty((self.grid_size, self.grid_size, 3), dtype=np.float32)
+        flat = out.reshape(self.n_cells, 3)
+        flat[:, 0] = self.signs
+        flat[:, 1] = self.ages.reshape(-1)
+        flat[:, 2] = self.signs
+        return out
 
     def _get_observation(self):
         """Convert game state to a numerical observation."""
-        obs = np.zeros((self.grid_size, self.grid_size, 3), dtype=np.float32)
-        for i in range(self.grid_size):
-            for j in range(self.grid_size):
-                if self.board[i, j] == "X":
-                    obs[i, j, 0] = 1
-                elif self.board[i, j] == "O":
-                    obs[i, j, 0] = -1
-                obs[i, j, 1] = self.ages[i, j]
-                if self.owners[i, j] == "X":
-                    obs[i, j, 2] = 1
-                elif self.owners[i, j] == "O":
-                    obs[i, j, 2] = -1
-        return obs
+        return self.observe(self._obs if self.reuse_observation else None)
+
+    def state_key(self):
+        """Integer key of the current state, equal to hash_state of the observation."""
+        return self._key
 
     def get_legal_actions(self):
         """Return a list of legal action indices."""
-        return [i * self.grid_size + j for i, j in 
-                [(i, j) for i in range(self.grid_size) for j in range(self.grid_size) if self.board[i, j] is None]]
+        return [c for c, taken in enumerate(self.occupied) if not taken]
+
+    def legal_action_mask(self, out=None):
+        """Boolean array over cells, True where a move is legal."""
+        return np.equal(np.frombuffer(self.occupied, dtype=np.uint8), 0, out=out)
+
+    def legal_bitmask(self):
+        """Legal moves as an int with bit c set when cell c is empty."""
+        return ~self.occupied_bits & ((1 << self.n_cells) - 1)
 
     def _update_ages(self):
         """Increment the age of all pieces."""
-        self.ages[self.board != None] += 1
+        self.ages.reshape(-1)[self.signs != 0] += 1
+        self._key += self._occupied_powers
 
     def _expire_pieces(self):
         """Remove pieces that exceed their lifespan, return True if any expired."""
-        expired = False
-        for i in range(self.grid_size):
-            for j in range(self.grid_size):
-                if self.board[i, j] is None:
-                    continue
-                lifespan = self.lifespan_x if self.owners[i, j] == "X" else self.lifespan_o
-                if self.ages[i, j] >= lifespan:
-                    self.board[i, j] = None
-                    self.ages[i, j] = 0
-                    self.owners[i, j] = None
-                    expired = True
-        return expired
+        ages = self.ages.reshape(-1)
+        lifespans = np.where(self.signs > 0, self.lifespan_x, self.lifespan_o)
+        expired = np.flatnonzero((self.signs != 0) & (ages >= lifespans)).tolist()
+        for cell in expired:
+            owner = self.owners.flat[cell]
+            self._update_lines(cell, owner, -1)
+            power = self.encoder.powers[cell]
+            self._key -= self.encoder.cell_digit(owner, int(ages[cell])) * power
+            self._occupied_powers -= power
+            self.signs[cell] = 0
+            self.board.flat[cell] = None
+            self.owners.flat[cell] = None
+            ages[cell] = 0
+        return bool(expired)
+
+    def _update_lines(self, cell, player, delta):
+        """Add (delta=1) or remove (delta=-1) player's piece at cell in the line counts and totals."""
+        opponent = "O" if player == "X" else "X"
+        mine, theirs = self.line_counts[player], self.line_counts[opponent]
+        for line in self.cell_lines[cell]:
+            m, t = mine[line], theirs[line]
+            self._tally(player, opponent, m, t, -1)
+            mine[line] = m + delta
+            self._tally(player, opponent, m + delta, t, 1)
+        self.occupied[cell] = delta > 0
+        self.occupied_bits ^= 1 << cell
+        self.empty_count -= delta
+
+    def _tally(self, player, opponent, mine, theirs, sign):
+        """Add sign times one line's contribution to the win and near-win totals."""
+        k = self.win_length
+        if mine == k:
+            self.wins[player] += sign
+        elif mine == k - 1 and theirs == 0:
+            self.near_wins[player] += sign
+        if theirs == k:
+            self.wins[opponent] += sign
+        elif theirs == k - 1 and mine == 0:
+            self.near_wins[opponent] += sign
 
     def _check_win(self, player):
         """Check if the specified player has won."""
-        for i in range(self.grid_size):
-            if sum(self.board[i, :] == player) >= 3:
-                return True
-            if sum(self.board[:, i] == player) >= 3:
-                return True
-        diag1 = sum(np.diag(self.board) == player)
-        diag2 = sum(np.diag(np.fliplr(self.board)) == player)
-        if diag1 >= 3 or diag2 >= 3:
-            return True
-        return False
+        return self.wins[player] > 0
 
     def _count_near_wins(self, player, before_move=False):
-        """Count the number of near-win opportunities for the player."""
-        board = self.board.copy() if before_move else self.board
-        if before_move:
-            temp_row, temp_col = np.where(self.ages == 0)
-            if len(temp_row) > 0:
-                board[temp_row[0], temp_col[0]] = None
-
-        count = 0
-        for i in range(self.grid_size):
-            row = board[i, :]
-            if sum(row == player) == 2 and sum(row == None) == 1:
-                count += 1
-            col = board[:, i]
-            if sum(col == player) == 2 and sum(col == None) == 1:
-                count += 1
-        diag1 = np.diag(board)
-        if sum(diag1 == player) == 2 and sum(diag1 == None) == 1:
-            count += 1
-        diag2 = np.diag(np.fliplr(board))
-        if sum(diag2 == player) == 2 and sum(diag2 == None) == 1:
-            count += 1
-        return count
\ No newline at end of file
+        """Count lines where the player is one piece short and the last cell is empty.
+
+        With before_move, count them on the board as it was before the last
+        piece was placed. The pre-move board is the current one with its
+        first age-0 cell in row-major order cleared; empty cells have age 0
+        too, so this only differs from the current board when the new piece
+        precedes every empty cell, and only on lines through that cell.
+        """
+        count = self.near_wins[player]
+        cell = self.last_cell
+        if not before_move or cell is None or self.occupied.find(0, 0, cell) >= 0:
+            return count
+        mover = self.board.flat[cell]
+        other = "O" if mover == "X" else "X"
+        k = self.win_length
+        for line in self.cell_lines[cell]:
+            m, t = self.line_counts[mover][line], self.line_counts[other][line]
+            if player == mover:
+                count += (m - 1 == k - 1 and t == 0) - (m == k - 1 and t == 0)
+            else:
+                count += (t == k - 1 and m == 1) - (t == k - 1 and m == 0)
+        return count
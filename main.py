@@ -1,28 +1,73 @@
-import pickle
-import pygame
+import os
 import numpy as np
 from env import EphemeralTicTacToeEnv
-from visualization import Visualizer
-from train import hash_state, update_q_table
+from train import GRID_SIZE, LIFESPAN_O, LIFESPAN_X, WIN_LENGTH, update_q_table
+from persistence import Q_TABLE_PATH, QTableCheckpointer, load_q_table_file, replay_delta_log, snapshot_path
+from q_store import Q_STORE_PATH, DenseQTable
+from state_keys import get_encoder, migrate_q_table
+from solver import EphemeralSolver, PerfectPlayer
+from replay_buffer import ReplayBuffer
+from symmetry import get_symmetry
 import random
 
 # Configuration switches
 GUI = True  # Set to False to disable GUI
 NRUNS = 1  # Number of games to simulate
+AI_OPPONENT = "qtable"  # "qtable" for the trained agent, "perfect" for the exact solver, "mcts" for tree search
+MCTS_TIME_BUDGET = 0.2  # Seconds the "mcts" opponent thinks per move
+MCTS_WORKERS = 1  # Processes searching in parallel for the "mcts" opponent (root parallelism)
+POLICY_SERVER = None  # Set to ("127.0.0.1", 8765) to get AI moves from a running policy_server.py
+RENDER_THREAD = False  # Draw the board on a separate thread (not supported by SDL on macOS)
 
 # Visualization delays (in milliseconds)
 MOVE_DELAY = 500
 END_GAME_DELAY = 1000
 
+def q_table_path():
+    """Where the Q-table for the configured board lives: the .qtab, or the .pkl for keys beyond int64."""
+    return snapshot_path(Q_STORE_PATH, get_encoder(GRID_SIZE, LIFESPAN_X, LIFESPAN_O))
+
 def load_q_table():
-    """Load trained Q-table."""
+    """Load trained Q-table, converting a pickled q_table_agent.pkl to the Q-store format once.
+
+    Boards whose state keys do not fit the Q-store keep their table pickled,
+    and it is loaded from there. Exits if the table was trained for another board.
+    """
     try:
-        with open("q_table_agent.pkl", "rb") as f:
-            q_table = pickle.load(f)
-        return q_table
+        path = q_table_path()
+        if path.endswith(".pkl"):
+            q_table = dense_table(load_q_table_file(path))
+        else:
+            if not os.path.exists(Q_STORE_PATH):
+                legacy = dense_table(load_q_table_file(Q_TABLE_PATH))
+                check_board(legacy)  # Before it is written out under the name main.py loads from
+                legacy.save(Q_STORE_PATH)
+            q_table = replay_delta_log(DenseQTable.open(Q_STORE_PATH, mode="c"), Q_STORE_PATH)
     except FileNotFoundError:
         print("Error: Q-table not found. Please run train.py first.")
         raise SystemExit
+    check_board(q_table)
+    return q_table
+
+def dense_table(q_table):
+    """A loaded pickle as a DenseQTable: plain dicts (older pickles) are rekeyed and sized by their rows."""
+    if hasattr(q_table, "n_actions"):
+        return q_table
+    n_actions = len(next(iter(q_table.values()), range(GRID_SIZE * GRID_SIZE)))
+    return DenseQTable.from_dict(migrate_q_table(q_table), n_actions)
+
+def check_board(q_table):
+    """Exit with a hint to retrain if q_table was trained for another board than the configured one."""
+    problem = q_table.board_mismatch(GRID_SIZE, LIFESPAN_X, LIFESPAN_O, WIN_LENGTH)
+    if problem:
+        print(f"Error: {problem}. Run train.py with the current GRID_SIZE, WIN_LENGTH and lifespans first.")
+        raise SystemExit
+
+def table_symmetry(q_table, env):
+    """Symmetry to look states up with, if the Q-table is keyed by canonical states."""
+    if getattr(q_table, "canonical", False):
+        return get_symmetry(env.grid_size, env.lifespan_x, env.lifespan_o)
+    return None
 
 class QTablePlayer:
     """Player that uses Q-table for action selection."""
@@ -30,23 +75,64 @@ class QTablePlayer:
         legal_actions = env.get_legal_actions()
         if not legal_actions:
             return None
-        state_key = hash_state(obs)
-        q_values = q_table.get(state_key, np.zeros(9))
+        return self.best_action(q_table, env.state_key(), legal_actions, table_symmetry(q_table, env))
+
+    @staticmethod
+    def best_action(q_table, state_key, legal_actions, symmetry=None):
+        """Legal action with the highest Q-value for a state key; unseen states count as all zeros."""
+        default = np.zeros(q_table.n_actions)
+        if symmetry is None:
+            q_values = q_table.get(state_key, default)
+        else:
+            q_values = symmetry.q_values(q_table, state_key, default)
         return max(legal_actions, key=lambda x: q_values[x])
 
-def play_human_vs_ai(gui=GUI, game_number=1):
-    """Play a game between human (X) and AI (O), updating Q-table after game."""
-    pygame.init()
-    q_table = load_q_table()
-    env = EphemeralTicTacToeEnv()
-    visualizer = Visualizer(gui=gui)
+class RemotePolicyPlayer:
+    """Player that asks a running policy server (policy_server.py) for its moves."""
+    def __init__(self, client):
+        self.client = client
+
+    def select_action(self, env, obs, q_table=None):
+        legal_actions = env.get_legal_actions()
+        if not legal_actions:
+            return None
+        return self.client.move(env.state_key(), legal_actions)
+
+def make_ai_player(kind, env):
+    """Build the AI opponent selected by AI_OPPONENT."""
+    if kind == "perfect":
+        return PerfectPlayer(EphemeralSolver(env.grid_size, env.lifespan_x, env.lifespan_o,
+                                             win_length=env.win_length).solve())
+    if kind == "mcts":
+        from mcts import MCTSPlayer, ParallelMCTSPlayer
+        if MCTS_WORKERS > 1:
+            return ParallelMCTSPlayer(MCTS_WORKERS, q_table_path=q_table_path(), time_budget=MCTS_TIME_BUDGET)
+        return MCTSPlayer(time_budget=MCTS_TIME_BUDGET)
+    return QTablePlayer()
+
+def play_human_vs_ai(gui=GUI, game_number=1, ai_opponent=AI_OPPONENT, q_table=None, client=None):
+    """Play a game between human (X) and AI (O), updating Q-table after game.
+
+    Pass the q_table loaded once per session, or a PolicyClient to let a
+    policy server choose the AI's moves and learn from the game instead.
+    """
+    if gui:  # pygame is only imported when the board is actually drawn
+        import pygame
+        from visualization import Visualizer
+        pygame.init()
+        visualizer = Visualizer(gui=gui, grid_size=GRID_SIZE, threaded=RENDER_THREAD)
+    if q_table is None and client is None:
+        q_table = load_q_table()
+    env = EphemeralTicTacToeEnv(GRID_SIZE, LIFESPAN_X, LIFESPAN_O, win_length=WIN_LENGTH)
+    if client is None and ai_opponent == "qtable":
+        check_board(q_table)
     obs = env.reset(starting_player="X")  # Human as X, AI as O
-    ai_player = QTablePlayer()
+    ai_player = RemotePolicyPlayer(client) if client is not None else make_ai_player(ai_opponent, env)
     action_history = [None, None, None]
-    game_history = []
     done = False
     step_count = 0
     max_steps = 20
+    game_history = ReplayBuffer(max_steps, env.encoder.key_dtype)
 
     # Render initial board state
     if gui:
@@ -60,28 +146,15 @@ def play_human_vs_ai(gui=GUI, game_number=1):
             break
 
         if env.current_player == "X":  # Human's turn
-            action = None
             if gui:
-                events = pygame.event.get()
-                for event in events:
-                    if event.type == pygame.QUIT:
-                        visualizer.close()
-                        raise SystemExit
-                    if event.type == pygame.MOUSEBUTTONDOWN:
-                        x, y = pygame.mouse.get_pos()
-                        row, col = y // 200, x // 200
-                        if 0 <= row < 3 and 0 <= col < 3:
-                            action = row * 3 + col
-                            if action not in legal_actions:
-                                action = None
-                if action is None:
-                    visualizer.refresh(obs, 0, False, {}, env, action_history)  # Keep screen updated
-                    continue
+                action = visualizer.wait_for_click(legal_actions)  # Sleeps until a legal cell is clicked
             else:
-                print("Legal moves:", [(a // 3, a % 3) for a in legal_actions])
+                print("Legal moves:", [divmod(a, env.grid_size) for a in legal_actions])
                 try:
                     row, col = map(int, input("Enter row, col (e.g., 0 1): ").split())
-                    action = row * 3 + col
+                    if not (0 <= row < env.grid_size and 0 <= col < env.grid_size):
+                        raise ValueError
+                    action = row * env.grid_size + col
                     if action not in legal_actions:
                         print("Illegal move!")
                         continue
@@ -97,8 +170,9 @@ def play_human_vs_ai(gui=GUI, game_number=1):
             print("No valid action, ending game.")
             break
 
+        state_key = env.state_key()
         next_obs, reward, done, info = env.step(action)
-        game_history.append((obs.copy(), action, reward, next_obs.copy(), done, env.current_player))
+        game_history.add(state_key, action, reward, env.state_key(), done, env.current_player, step_count)
         if gui:
             visualizer.refresh(next_obs, reward, done, info, env, action_history)
             pygame.time.wait(MOVE_DELAY)
@@ -106,9 +180,9 @@ def play_human_vs_ai(gui=GUI, game_number=1):
         obs = next_obs
         step_count += 1
 
+    winner = info["player"] if done and reward == 1 else None
     if done:
-        if reward == 1:
-            winner = info['player']
+        if winner is not None:
             winner_name = "Human" if winner == "X" else "AI"
             print(f"{winner_name} ({winner}) wins!")
         else:
@@ -116,23 +190,36 @@ def play_human_vs_ai(gui=GUI, game_number=1):
     else:
         print("Game ended with no winner (max steps reached).")
 
-    # Update Q-table with game history
-    update_q_table(game_history, q_table, alpha=0.1, gamma=0.95)
-
+    if client is not None:  # The server batches the update and writes it to disk in the background
+        client.update(game_history.view())
+    else:
+        # Update Q-table with game history and append the changed rows to the delta log
+        checkpointer = QTableCheckpointer(q_table_path(), delta_log=True)
+        update_q_table(game_history.view(), q_table, alpha=0.1, gamma=0.95, checkpointer=checkpointer,
+                       symmetry=table_symmetry(q_table, env))
+        checkpointer.save(q_table)
+
+    if hasattr(ai_player, "close"):
+        ai_player.close()
     if gui:
-        pygame.display.flip()
         pygame.time.wait(END_GAME_DELAY)
         visualizer.check_quit()
-    visualizer.close()
-    return None if not done else winner
+        visualizer.close()
+    return winner
 
-def simulate_games(nruns=NRUNS, gui=GUI):
-    """Simulate multiple human vs AI games."""
+def simulate_games(nruns=NRUNS, gui=GUI, policy_server=POLICY_SERVER):
+    """Simulate multiple human vs AI games, loading the Q-table (or connecting to the server) once."""
     wins = [0, 0, 0]  # [draws, human wins, AI wins]
+    q_table = client = None
+    if policy_server:
+        from policy_server import PolicyClient
+        client = PolicyClient(*policy_server)
+    else:
+        q_table = load_q_table()
 
     for n in range(1, nruns + 1):
         print(f"\nRun {n}")
-        result = play_human_vs_ai(gui=gui, game_number=n)
+        result = play_human_vs_ai(gui=gui, game_number=n, q_table=q_table, client=client)
         if result is None:
             wins[0] += 1
             print("Draw!")
@@ -146,6 +233,8 @@ def simulate_games(nruns=NRUNS, gui=GUI):
         print(f"Stats: Draws={wins[0]}, Human={wins[1]}, AI={wins[2]}")
         print(f"Win rates: {', '.join([f'{v/n:.2f}' for v, n in zip(wins, [n, n, n])])}")
 
+    if client is not None:
+        client.close()
     return wins
 
 if __name__ == "__main__":
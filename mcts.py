@@ -0,0 +1,276 @@
+import math
+import multiprocessing as mp
+import time
+import numpy as np
+from batch_env import BatchEphemeralTicTacToeEnv
+from bitboard_env import BitboardTicTacToeEnv
+from persistence import load_q_table_file, replay_delta_log
+from q_store import DenseQTable
+from symmetry import get_symmetry
+
+# Configuration switches
+TIME_BUDGET = 0.2  # Seconds of search per move
+ITERATIONS = None  # Or a fixed number of simulations per move (whichever budget runs out first)
+EXPLORATION = 1.4  # Weight of the exploration term in the PUCT score
+ROLLOUT_BATCH = 128  # Leaves selected (with virtual loss) and rolled out together per batch
+ROLLOUT_DEPTH = 40  # Plies after which an unfinished rollout counts as a draw
+PRIOR_TEMPERATURE = 0.2  # Softmax temperature turning Q-values into move priors
+
+
+class Node:
+    """Search tree node: the state (as from env.get_state()) reached after `mover` played into it."""
+    __slots__ = ("state", "mover", "visits", "value", "priors", "children", "result")
+
+    def __init__(self, state, mover, priors=None, result=None):
+        self.state = state
+        self.mover = mover
+        self.visits = 0
+        self.value = 0.0  # Sum of results from the mover's point of view
+        self.priors = priors  # {action: prior} over the legal moves; empty once the game is over
+        self.children = {}
+        self.result = result  # Mover's result if the game ended here: 1 win, 0 draw
+
+
+class MCTSPlayer:
+    """Monte Carlo Tree Search player with batched random rollouts.
+
+    Tree nodes hold compact get_state() values, so a simulation walks the
+    tree with PUCT and only touches an env to add a leaf: a bitboard env is
+    set to the parent's state and stepped once. A virtual loss on the path spreads each batch over
+    different leaves, and the batch's ROLLOUT_BATCH leaves are played out at
+    once on a BatchEphemeralTicTacToeEnv. With a Q-table, a softmax over its
+    Q-values weights the exploration of each move; unseen states fall back
+    to uniform priors. The tree is kept between moves: the next search starts
+    from the node two plies down that matches the new position.
+    """
+
+    def __init__(self, time_budget=TIME_BUDGET, iterations=ITERATIONS, exploration=EXPLORATION,
+                 rollout_batch=ROLLOUT_BATCH, rollout_depth=ROLLOUT_DEPTH, use_prior=True,
+                 prior_temperature=PRIOR_TEMPERATURE, seed=None):
+        if time_budget is None and iterations is None:
+            raise ValueError("MCTSPlayer needs a time_budget, an iterations budget or both")
+        self.time_budget = time_budget
+        self.iterations = iterations
+        self.exploration = exploration
+        self.rollout_batch = rollout_batch
+        self.rollout_depth = rollout_depth
+        self.use_prior = use_prior
+        self.prior_temperature = prior_temperature
+        self.seed = seed
+        self.root = None
+        self.config = None  # Board settings the rollout and search envs were built for
+        self.rollouts = None
+        self.sim = None
+        self.stats = {"simulations": 0, "reused": 0}
+
+    def select_action(self, env, obs, q_table=None):
+        counts = self.search(env, q_table)
+        if not counts:
+            return None
+        return max(counts, key=lambda a: (counts[a], self._mean(self.root.children.get(a))))
+
+    def search(self, env, q_table=None):
+        """Search from env's current state and return the visit count of each root move."""
+        if not env.get_legal_actions():
+            return {}
+        config = (env.grid_size, env.lifespan_x, env.lifespan_o, env.win_length)
+        if self.config != config:
+            self.rollouts = BatchEphemeralTicTacToeEnv(self.rollout_batch, env.grid_size, env.lifespan_x,
+                                                       env.lifespan_o, seed=self.seed, win_length=env.win_length)
+            self.sim = BitboardTicTacToeEnv(*config)
+            self.root = None
+            self.config = config
+        if not self.use_prior or q_table is None or q_table.board_mismatch(*config):
+            q_table = None
+        symmetry = get_symmetry(env.grid_size, env.lifespan_x, env.lifespan_o) if getattr(q_table, "canonical", False) else None
+
+        self.root = self._find_root(env, q_table, symmetry)
+        deadline = None if self.time_budget is None else time.perf_counter() + self.time_budget
+        done = 0
+        while True:
+            batch = self.rollout_batch if self.iterations is None else min(self.rollout_batch, self.iterations - done)
+            if batch <= 0:
+                break
+            self._run_batch(batch, q_table, symmetry)
+            done += batch
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        self.stats["simulations"] += done
+        return {action: child.visits for action, child in self.root.children.items()}
+
+    def _find_root(self, env, q_table, symmetry):
+        """Node for env's position in the kept tree (at most two plies below the last root), or a new one."""
+        state = env.get_state()
+        frontier = [self.root] if self.root is not None else []
+        for _ in range(3):
+            for node in frontier:
+                if node.state[:2] == state[:2]:  # Same position and player to move; the move count does not matter
+                    self.stats["reused"] += node.visits
+                    return node
+            frontier = [child for node in frontier for child in node.children.values()]
+        return Node(state, "O" if env.current_player == "X" else "X", self._priors(env, q_table, symmetry))
+
+    def _run_batch(self, batch, q_table, symmetry):
+        """Select `batch` leaves, roll the open ones out together and back the results up."""
+        sim = self.sim
+        paths, leaves = [], []
+        for _ in range(batch):
+            node = self.root
+            path = [node]
+            leaf = None
+            while node.result is None:
+                if not node.priors:
+                    sim.set_state(node.state)
+                    leaf = self._leaf_state(sim)
+                    break
+                action = self._select(node)
+                child = node.children.get(action)
+                if child is None:
+                    sim.set_state(node.state)
+                    mover = sim.current_player
+                    _, reward, done, _ = sim.step_key(action)
+                    if done:
+                        child = Node(sim.get_state(), mover, {}, 1 if reward == 1 else 0)
+                    else:
+                        child = Node(sim.get_state(), mover, self._priors(sim, q_table, symmetry))
+                        leaf = self._leaf_state(sim)
+                    node.children[action] = child
+                    path.append(child)
+                    break
+                node = child
+                path.append(node)
+            for n in path:  # Virtual loss, so the rest of the batch looks elsewhere
+                n.visits += 1
+                n.value -= 1
+            paths.append(path)
+            leaves.append(leaf)
+
+        winners = self._rollout([leaf for leaf in leaves if leaf is not None])
+        it = iter(winners.tolist())
+        for path, leaf in zip(paths, leaves):
+            end = path[-1]
+            if leaf is None:
+                result, winner_mover = end.result, end.mover
+            else:
+                winner = next(it)
+                result, winner_mover = (abs(winner), "X" if winner > 0 else "O")
+            for n in path:
+                n.value += 1  # Undo the virtual loss
+                n.value += result if n.mover == winner_mover else -result
+
+    @staticmethod
+    def _leaf_state(env):
+        """(signs, ages, player) of env's position, in the batch env's encoding."""
+        obs = env.observe().reshape(-1, 3)
+        return obs[:, 0], obs[:, 1], 1 if env.current_player == "X" else -1
+
+    def _rollout(self, leaves):
+        """Play the leaf positions out with random moves; return each winner (1 X, -1 O, 0 none)."""
+        n = len(leaves)
+        if not n:
+            return np.zeros(0, dtype=np.int8)
+        rollouts = self.rollouts
+        for i in range(rollouts.num_envs):  # Spare games repeat the first leaf; their results are ignored
+            signs, ages, player = leaves[i if i < n else 0]
+            rollouts.board[i] = signs
+            rollouts.ages[i] = ages
+            rollouts.current_player[i] = player
+        rollouts.episode_steps[:] = 0
+        winners = np.zeros(n, dtype=np.int8)
+        live = np.ones(n, dtype=bool)
+        for _ in range(self.rollout_depth):
+            _, _, dones, info = rollouts.step(rollouts.random_actions())
+            finished = dones[:n] & live
+            winners[finished] = info["winner"][:n][finished]
+            live &= ~dones[:n]
+            if not live.any():
+                break
+        return winners
+
+    def _priors(self, env, q_table, symmetry):
+        """{action: prior} for env's legal moves, scaled so a uniform prior is 1 per move."""
+        legal_actions = env.get_legal_actions()
+        q_values = None
+        if q_table is not None:
+            key = env.state_key()
+            q_values = q_table.get(key) if symmetry is None else symmetry.q_values(q_table, key)
+        if q_values is None:
+            return dict.fromkeys(legal_actions, 1.0)
+        q = np.asarray(q_values, dtype=np.float64)[legal_actions]
+        weights = np.exp((q - q.max()) / self.prior_temperature)
+        return dict(zip(legal_actions, (weights * (len(legal_actions) / weights.sum())).tolist()))
+
+    def _select(self, node):
+        """Action maximizing mean value plus the prior-weighted exploration bonus."""
+        scale = self.exploration * math.sqrt(node.visits + 1)
+        children = node.children
+        best, best_score = None, -math.inf
+        for action, prior in node.priors.items():
+            child = children.get(action)
+            if child is None:
+                score = scale * prior
+            else:
+                score = child.value / child.visits + scale * prior / (1 + child.visits)
+            if score > best_score:
+                best, best_score = action, score
+        return best
+
+    @staticmethod
+    def _mean(node):
+        return node.value / node.visits if node is not None and node.visits else -math.inf
+
+
+def _search_worker(conn, q_table_path, options):
+    """Run one MCTSPlayer on the envs sent by ParallelMCTSPlayer, keeping its tree between moves."""
+    if not q_table_path:
+        q_table = None
+    elif q_table_path.endswith(".pkl"):  # Boards whose keys do not fit the Q-store
+        q_table = load_q_table_file(q_table_path)
+    else:
+        q_table = replay_delta_log(DenseQTable.open(q_table_path, mode="c"), q_table_path)
+    player = MCTSPlayer(**options)
+    while True:
+        env = conn.recv()
+        if env is None:
+            break
+        problem = q_table is not None and q_table.board_mismatch(env.grid_size, env.lifespan_x, env.lifespan_o, env.win_length)
+        if problem:  # Search on with uniform priors rather than leave the player waiting for an answer
+            print(f"Error: {problem}. Run train.py with the current GRID_SIZE, WIN_LENGTH and lifespans first.")
+            q_table = None
+        conn.send(player.search(env, q_table))
+
+
+class ParallelMCTSPlayer:
+    """Root-parallel MCTS: every worker process grows its own tree and root visit counts are summed.
+
+    Workers get different rollout seeds, and each loads the Q-table prior
+    from q_table_path itself (None for uniform priors). Call close() when
+    done to stop the workers.
+    """
+
+    def __init__(self, workers=mp.cpu_count(), q_table_path=None, seed=0, **options):
+        ctx = mp.get_context("spawn")
+        self.pipes, self.processes = [], []
+        for worker_id in range(workers):
+            parent, child = ctx.Pipe()
+            worker_options = dict(options, seed=seed * 1009 + worker_id)
+            process = ctx.Process(target=_search_worker, args=(child, q_table_path, worker_options), daemon=True)
+            process.start()
+            self.pipes.append(parent)
+            self.processes.append(process)
+
+    def select_action(self, env, obs, q_table=None):
+        for conn in self.pipes:
+            conn.send(env)
+        counts = {}
+        for conn in self.pipes:
+            for action, visits in conn.recv().items():
+                counts[action] = counts.get(action, 0) + visits
+        return max(counts, key=counts.get) if counts else None
+
+    def close(self):
+        for conn in self.pipes:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+        self.pipes, self.processes = [], []
@@ -0,0 +1,151 @@
+import multiprocessing as mp
+import random
+import time
+import numpy as np
+from bitboard_env import BitboardTicTacToeEnv
+from persistence import QTableCheckpointer
+from q_store import Q_STORE_PATH, DenseQTable
+from replay_buffer import ReplayBuffer
+from symmetry import get_symmetry
+from state_keys import get_encoder
+from train import (EPISODES, CHECKPOINT_EVERY, GRID_SIZE, LIFESPAN_O, LIFESPAN_X, REPLAY_CAPACITY, SYMMETRY,
+                   WIN_LENGTH, announce_snapshot_path, play_episode, update_q_table)
+
+# Configuration switches
+WORKERS = mp.cpu_count()  # Worker processes generating episodes
+SYNC_EVERY = 250  # Episodes each worker plays between merges
+SEED = 0
+
+
+class RowTracker:
+    """Collects the Q-table rows update_q_table touches (stands in for a checkpointer)."""
+    def __init__(self):
+        self.dirty = set()
+
+    def mark(self, state_key):
+        self.dirty.add(state_key)
+
+
+def _worker(conn, gamma, use_symmetry, grid_size, win_length, lifespan_x, lifespan_o):
+    """Keep a local Q-table in sync with the learner and return Q-deltas for each round.
+
+    Each message is (sync_rows, seed, episode_indices, epsilon, decay_rate);
+    sync_rows are the learner's merged values for every row changed last round,
+    which brings the local table back to the learner's table exactly.
+    """
+    env = BitboardTicTacToeEnv(grid_size, lifespan_x, lifespan_o, win_length=win_length)
+    symmetry = get_symmetry(env.grid_size, env.lifespan_x, env.lifespan_o) if use_symmetry else None
+    q_table = DenseQTable(env.n_cells)
+    buffer = ReplayBuffer(REPLAY_CAPACITY, env.encoder.key_dtype)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        sync_rows, seed, episode_indices, epsilon, decay_rate = message
+        for key, values in sync_rows.items():
+            q_table[key] = values
+        random.seed(seed)
+        np.random.seed(seed % 2 ** 32)
+
+        start_size = q_table.size
+        start_values = q_table.values[:start_size].copy()
+        tracker = RowTracker()
+        wins = {"Agent": 0, "Random": 0, "Draw": 0}
+        rewards = []
+        for episode in episode_indices:
+            game_history, reward, done, info = play_episode(env, q_table, epsilon * (decay_rate ** episode), buffer,
+                                                            symmetry=symmetry)
+            if done and reward == 1:
+                wins["Agent" if info["player"] == "X" else "Random"] += 1
+            elif done:
+                wins["Draw"] += 1
+            rewards.extend(game_history.rewards.tolist())
+            update_q_table(game_history, q_table, alpha=0.5, gamma=gamma, checkpointer=tracker,
+                           symmetry=symmetry)
+
+        deltas = {}
+        for key in tracker.dirty:
+            row = q_table.index[key]
+            deltas[key] = q_table.values[row] - start_values[row] if row < start_size else q_table.values[row].copy()
+        conn.send((deltas, wins, rewards))
+
+
+def train_parallel(episodes=EPISODES, workers=WORKERS, sync_every=SYNC_EVERY, gamma=0.95, epsilon=1.0,
+                   decay_rate=0.9995, seed=SEED, checkpoint_every=CHECKPOINT_EVERY, q_table_path=Q_STORE_PATH,
+                   use_symmetry=SYMMETRY, grid_size=GRID_SIZE, win_length=WIN_LENGTH,
+                   lifespan_x=LIFESPAN_X, lifespan_o=LIFESPAN_O):
+    """Train the Q-learning agent against random moves on a pool of worker processes.
+
+    Every round each worker plays `sync_every` episodes from its own slice of
+    the global episode schedule, so epsilon decays exactly as in the serial
+    loop. The learner adds the Q-deltas from all workers, in worker order, to
+    the master table and sends the merged rows back before the next round.
+    Worker seeds derive from `seed`, round and worker index, so runs are
+    reproducible for a fixed seed and worker count.
+    """
+    q_table_path = announce_snapshot_path(q_table_path, get_encoder(grid_size, lifespan_x, lifespan_o))
+    ctx = mp.get_context("spawn")
+    pipes, processes = [], []
+    for _ in range(workers):
+        parent, child = ctx.Pipe()
+        process = ctx.Process(target=_worker, args=(child, gamma, use_symmetry, grid_size, win_length, lifespan_x, lifespan_o),
+                              daemon=True)
+        process.start()
+        pipes.append(parent)
+        processes.append(process)
+
+    q_table = DenseQTable(grid_size * grid_size, board=(grid_size, lifespan_x, lifespan_o, win_length))
+    q_table.canonical = use_symmetry
+    checkpointer = QTableCheckpointer(q_table_path, every_episodes=checkpoint_every)
+    total_wins = {"Agent": 0, "Random": 0, "Draw": 0}
+    sync_rows = {}
+    episode = 0
+    start = time.perf_counter()
+    try:
+        round_number = 0
+        while episode < episodes:
+            round_size = min(workers * sync_every, episodes - episode)
+            slices = np.array_split(np.arange(episode, episode + round_size), workers)
+            for worker_id, (conn, indices) in enumerate(zip(pipes, slices)):
+                worker_seed = (seed * 1_000_003 + round_number) * 1009 + worker_id
+                conn.send((sync_rows, worker_seed, indices.tolist(), epsilon, decay_rate))
+
+            touched = set()
+            rewards = []
+            for conn in pipes:
+                deltas, wins, worker_rewards = conn.recv()
+                for key, delta in deltas.items():
+                    if key in q_table:
+                        q_table[key] += delta
+                    else:
+                        q_table[key] = delta
+                    checkpointer.mark(key)
+                touched.update(deltas)
+                rewards.extend(worker_rewards)
+                for outcome, count in wins.items():
+                    total_wins[outcome] += count
+            sync_rows = {key: np.array(q_table[key]) for key in touched}
+
+            episode += round_size
+            round_number += 1
+            avg_reward = sum(rewards) / max(1, len(rewards))
+            elapsed = time.perf_counter() - start
+            print(f"Episode: {episode}/{episodes}, Avg Reward: {avg_reward:.3f}, "
+                  f"Epsilon: {epsilon * decay_rate ** episode:.3f}, Episodes/sec: {episode / elapsed:,.0f}")
+            if checkpoint_every and episode // checkpoint_every > (episode - round_size) // checkpoint_every:
+                checkpointer.save(q_table)
+    finally:
+        for conn in pipes:
+            conn.send(None)
+        for process in processes:
+            process.join()
+
+    print("\nTraining Complete!")
+    print(f"Total Wins - Agent: {total_wins['Agent']}, Random: {total_wins['Random']}, Draw: {total_wins['Draw']}")
+
+    checkpointer.compact(q_table)
+    return q_table
+
+
+if __name__ == "__main__":
+    q_table = train_parallel()
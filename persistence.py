@@ -0,0 +1,150 @@
+import os
+import pickle
+import tempfile
+import time
+import numpy as np
+
+Q_TABLE_PATH = "q_table_agent.pkl"
+_UMASK = os.umask(0)  # Read once at import; os.umask can only be read by setting it
+os.umask(_UMASK)
+
+
+def atomic_write(path, write):
+    """Call write(f) on a temp file next to path, then rename it over path.
+
+    Readers never see a partially written file. The file keeps the mode of
+    the one it replaces, or gets the mode open() would give a new file;
+    mkstemp alone would leave it readable by its owner only.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def atomic_pickle_dump(obj, path):
+    """Pickle obj to path atomically."""
+    atomic_write(path, lambda f: pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def replay_delta_log(q_table, path):
+    """Apply the delta log written next to the snapshot at path, if any, to q_table."""
+    log_path = path + ".log"
+    if not os.path.exists(log_path):
+        return q_table
+    with open(log_path, "rb") as f:
+        while True:
+            try:
+                delta = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                break  # End of log, or a record cut short by a crash
+            for key, values in delta.items():
+                q_table[key] = values
+    return q_table
+
+
+def load_q_table_file(path=Q_TABLE_PATH):
+    """Load a pickled Q-table snapshot and replay its delta log on top of it."""
+    with open(path, "rb") as f:
+        q_table = pickle.load(f)
+    return replay_delta_log(q_table, path)
+
+
+def snapshot_path(path, encoder):
+    """path, or a .pkl named after the board (e.g. q_table_agent_5x5.pkl) when the encoder's keys do not fit a .qtab.
+
+    The board size in the name keeps these snapshots apart from a legacy
+    q_table_agent.pkl and from each other.
+    """
+    if encoder.key_dtype is object and not path.endswith(".pkl"):
+        return f"{os.path.splitext(path)[0]}_{encoder.grid_size}x{encoder.grid_size}.pkl"
+    return path
+
+
+def write_snapshot(q_table, path):
+    """Atomically write a full snapshot: tables with a save() method use their own format unless path is a .pkl.
+
+    Such tables are pickled whole, so a .pkl keeps their action count and
+    canonical flag; plain dicts are pickled as they are.
+    """
+    if hasattr(q_table, "save"):
+        if path.endswith(".pkl"):
+            atomic_pickle_dump(q_table.copy(), path)
+        else:
+            q_table.save(path)
+    else:
+        atomic_pickle_dump(dict(q_table), path)
+
+
+class QTableCheckpointer:
+    """Decides when to persist a Q-table and how.
+
+    A checkpoint is taken every `every_episodes` episodes and/or every
+    `every_seconds` seconds, or on demand with save(). With `delta_log` set,
+    checkpoints only append the rows touched since the last one to
+    `<path>.log`, so their cost follows the number of updates rather than
+    the table size; compact() folds the log back into the snapshot, and
+    happens automatically once the log grows past `compact_bytes`.
+    """
+
+    def __init__(self, path=Q_TABLE_PATH, every_episodes=None, every_seconds=None, delta_log=False,
+                 compact_bytes=16 * 1024 * 1024):
+        self.path = path
+        self.log_path = path + ".log"
+        self.every_episodes = every_episodes
+        self.every_seconds = every_seconds
+        self.delta_log = delta_log
+        self.compact_bytes = compact_bytes
+        self.dirty = set()
+        self.last_save = time.monotonic()
+
+    def mark(self, state_key):
+        """Record that a Q-table row changed since the last checkpoint."""
+        self.dirty.add(state_key)
+
+    def maybe_save(self, q_table, episode):
+        """Checkpoint if the episode or time interval has elapsed; return True if saved."""
+        due = self.every_episodes and (episode + 1) % self.every_episodes == 0
+        if not due and self.every_seconds:
+            due = time.monotonic() - self.last_save >= self.every_seconds
+        if due:
+            self.save(q_table)
+        return bool(due)
+
+    def save(self, q_table):
+        """Checkpoint now: append a delta if logging, otherwise write a full snapshot."""
+        if self.delta_log and os.path.exists(self.path):
+            if self.dirty:
+                delta = {key: np.array(q_table[key]) for key in self.dirty}
+                with open(self.log_path, "ab") as f:
+                    pickle.dump(delta, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    log_size = f.tell()
+                if self.compact_bytes and log_size >= self.compact_bytes:
+                    self.compact(q_table)
+                    return
+        else:
+            write_snapshot(q_table, self.path)
+        self.dirty.clear()
+        self.last_save = time.monotonic()
+
+    def compact(self, q_table):
+        """Write a full snapshot atomically and drop the delta log it supersedes."""
+        write_snapshot(q_table, self.path)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self.dirty.clear()
+        self.last_save = time.monotonic()
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import numpy as np
+from main import QTablePlayer, load_q_table, q_table_path
+from parallel_train import RowTracker
+from persistence import QTableCheckpointer
+from q_store import Q_STORE_PATH
+from replay_buffer import COLUMNS, Transitions
+from state_keys import get_encoder
+from symmetry import get_symmetry
+from train import GRID_SIZE, LIFESPAN_O, LIFESPAN_X, WIN_LENGTH, batch_update_q_table
+
+# Configuration switches
+HOST = "127.0.0.1"
+PORT = 8765
+BATCH_SIZE = 64  # Most games folded into one Q-update
+BATCH_WAIT = 0.005  # Seconds to wait for more games before applying a batch
+SNAPSHOT_EVERY = 10.0  # Seconds between background writes of the changed rows
+COMPACT_BYTES = 16 * 1024 * 1024  # Fold the delta log into the .qtab snapshot once it grows past this
+
+
+class PolicyServer:
+    """Serves Q-table moves to many concurrent games over newline-delimited JSON on a local socket.
+
+    Requests and replies are one JSON object per line:
+      {"op": "move", "state": key, "legal": [actions]} -> {"action": a}
+      {"op": "update", "episode": {column: [values]}}   -> {"queued": n}
+      {"op": "stats"}                                   -> counters
+    The table is loaded once and only touched on the event loop, so moves
+    never wait for disk. Finished games are queued and applied together with
+    batch_update_q_table; every SNAPSHOT_EVERY seconds the changed rows are
+    copied on the loop and appended to the delta log from a worker thread.
+    """
+
+    def __init__(self, q_table, path=Q_STORE_PATH, alpha=0.1, gamma=0.95, batch_size=BATCH_SIZE,
+                 batch_wait=BATCH_WAIT, snapshot_every=SNAPSHOT_EVERY, grid_size=GRID_SIZE,
+                 lifespan_x=LIFESPAN_X, lifespan_o=LIFESPAN_O, win_length=WIN_LENGTH):
+        problem = q_table.board_mismatch(grid_size, lifespan_x, lifespan_o, win_length)
+        if problem:
+            print(f"Error: {problem}. Run train.py with the current GRID_SIZE, WIN_LENGTH and lifespans first.")
+            raise SystemExit
+        self.q_table = q_table
+        self.alpha = alpha
+        self.gamma = gamma
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.snapshot_every = snapshot_every
+        self.symmetry = get_symmetry(grid_size, lifespan_x, lifespan_o) if q_table.canonical else None
+        self.encoder = get_encoder(grid_size, lifespan_x, lifespan_o)
+        self.max_key = self.encoder.base ** self.encoder.n_cells
+        self.writer = QTableCheckpointer(path, delta_log=True, compact_bytes=None)
+        self.write_lock = threading.Lock()  # A background write may still be running when flush() starts
+        self.tracker = RowTracker()
+        self.pending = []
+        self.updated = None  # asyncio.Event, created on the server's loop
+        self.stats = {"moves": 0, "games": 0, "batches": 0, "dropped": 0, "snapshots": 0}
+
+    async def handle(self, reader, writer):
+        """Answer requests from one connection until it closes."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = self.dispatch(json.loads(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {"error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def dispatch(self, request):
+        op = request["op"]
+        if op == "move":
+            legal = request["legal"]
+            if not legal or not all(type(a) is int and 0 <= a < self.q_table.n_actions for a in legal):
+                raise ValueError(f"legal must list cells 0 to {self.q_table.n_actions - 1}")
+            state = request["state"]
+            if not self._is_state_key(state):
+                raise ValueError("state is not a state key")
+            self.stats["moves"] += 1
+            return {"action": QTablePlayer.best_action(self.q_table, state, legal, self.symmetry)}
+        if op == "update":
+            self.pending.append(self._episode(request["episode"]))
+            self.updated.set()
+            return {"queued": len(self.pending)}
+        if op == "stats":
+            return dict(self.stats, states=len(self.q_table), pending=len(self.pending))
+        raise ValueError(f"unknown op {op!r}")
+
+    def _episode(self, episode):
+        """Transitions for one game sent as {column: [values]}, checked before it is queued.
+
+        Anything batch_update_q_table could fail on is rejected here, so a
+        bad game gets an error reply instead of breaking a whole batch.
+        """
+        n = len(episode["states"])
+        columns = []
+        for name, dtype in COLUMNS.items():
+            if name == "steps":  # Renumbered so each game starts at 0, which is how batches find game boundaries
+                columns.append(np.arange(n, dtype=dtype))
+                continue
+            values = episode[name]
+            if name.endswith("states"):
+                if not all(map(self._is_state_key, values)):
+                    raise ValueError(f"episode column {name!r} holds values that are not state keys")
+                dtype = self.encoder.key_dtype
+            elif name == "actions":
+                if not all(type(a) is int and 0 <= a < self.q_table.n_actions for a in values):
+                    raise ValueError(f"episode actions must be cells 0 to {self.q_table.n_actions - 1}")
+            elif name == "players":
+                if not all(p in (1, -1) for p in values):
+                    raise ValueError("episode players must be 1 (X) or -1 (O)")
+            columns.append(np.array(values, dtype=dtype))
+            if columns[-1].shape != (n,):
+                raise ValueError(f"episode column {name!r} does not hold {n} values")
+        return Transitions(*columns)
+
+    def _is_state_key(self, key):
+        """True for an int that encodes a board of this server's configuration."""
+        return type(key) is int and 0 <= key < self.max_key
+
+    def apply_pending(self):
+        """Apply up to batch_size queued games as one batched Q-update."""
+        episodes, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+        if not episodes:
+            return
+        transitions = Transitions(*(np.concatenate(columns) for columns in zip(*episodes)))
+        batch_update_q_table(transitions, self.q_table, alpha=self.alpha, gamma=self.gamma,
+                             checkpointer=self.tracker, symmetry=self.symmetry)
+        self.stats["games"] += len(episodes)
+        self.stats["batches"] += 1
+
+    def _apply_or_drop(self):
+        """apply_pending(), dropping and reporting a batch that fails instead of letting it stop the server."""
+        try:
+            self.apply_pending()
+        except Exception as e:  # The batch is already off the queue
+            self.stats["dropped"] += 1
+            print(f"Dropped a batch of updates: {type(e).__name__}: {e}", file=sys.stderr)
+
+    async def _batch_updates(self):
+        while True:
+            await self.updated.wait()
+            if len(self.pending) < self.batch_size:
+                await asyncio.sleep(self.batch_wait)  # Let more games arrive before paying for an update
+            self._apply_or_drop()
+            if not self.pending:
+                self.updated.clear()
+
+    def _take_snapshot(self):
+        """Copy what needs writing while no update can run: the changed rows, plus the whole table to compact."""
+        delta = {key: np.array(self.q_table[key]) for key in self.tracker.dirty}
+        self.tracker.dirty.clear()
+        log_size = os.path.getsize(self.writer.log_path) if os.path.exists(self.writer.log_path) else 0
+        compact = not os.path.exists(self.writer.path) or log_size >= COMPACT_BYTES
+        return delta, self.q_table.copy() if compact else None
+
+    def _write_snapshot(self, delta, full):
+        with self.write_lock:
+            if full is not None:
+                self.writer.compact(full)
+            elif delta:
+                self.writer.dirty = set(delta)
+                self.writer.save(delta)
+
+    async def _snapshots(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.snapshot_every)
+            delta, full = self._take_snapshot()
+            if delta or full is not None:
+                await loop.run_in_executor(None, self._write_snapshot, delta, full)
+                self.stats["snapshots"] += 1
+
+    def flush(self):
+        """Apply every queued game and write the changes now (used on shutdown)."""
+        while self.pending:
+            self._apply_or_drop()
+        self._write_snapshot(*self._take_snapshot())
+
+    async def serve(self, host=HOST, port=PORT):
+        """Serve until cancelled (or sent SIGTERM), then flush pending updates to disk."""
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except (NotImplementedError, RuntimeError):
+            pass  # No signal handlers on Windows or outside the main thread
+        self.updated = asyncio.Event()
+        server = await asyncio.start_server(self.handle, host, port)
+        tasks = [asyncio.create_task(self._batch_updates()), asyncio.create_task(self._snapshots())]
+        print(f"Policy server listening on {host}:{port} ({len(self.q_table)} states)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.flush()
+
+
+class PolicyClient:
+    """Blocking client for PolicyServer; one connection, one request in flight."""
+
+    def __init__(self, host=HOST, port=PORT, timeout=5.0):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile("rwb")
+
+    def request(self, message):
+        self.file.write(json.dumps(message).encode() + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("policy server closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"policy server: {response['error']}")
+        return response
+
+    def move(self, state_key, legal_actions):
+        """Greedy action for the state among legal_actions."""
+        return self.request({"op": "move", "state": state_key, "legal": legal_actions})["action"]
+
+    def update(self, transitions):
+        """Queue one finished game (Transitions, e.g. a ReplayBuffer view) for learning."""
+        episode = {name: column.tolist() for name, column in transitions._asdict().items()}
+        return self.request({"op": "update", "episode": episode})["queued"]
+
+    def stats(self):
+        return self.request({"op": "stats"})
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    policy_server = PolicyServer(load_q_table(), q_table_path())
+    print(f"Q-table loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+    host = sys.argv[1] if len(sys.argv) > 1 else HOST
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else PORT
+    try:
+        asyncio.run(policy_server.serve(host, port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
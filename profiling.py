@@ -0,0 +1,114 @@
+import cProfile
+import signal
+import time
+from collections import Counter, defaultdict
+
+
+class PhaseTimer:
+    """Accumulated wall time and call counts per training phase.
+
+    Code being timed calls lap(phase, start) with the perf_counter value from
+    the end of the previous phase and gets the current one back, so timing a
+    sequence of phases costs one clock read each. Callers pass None instead
+    of a PhaseTimer to turn timing off and skip even that.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.episodes = 0
+
+    def lap(self, phase, start):
+        """Charge the time since start to phase and return the current time."""
+        now = time.perf_counter()
+        self.seconds[phase] += now - start
+        self.calls[phase] += 1
+        return now
+
+    def snapshot(self):
+        """Copy of the counters, to summarize only what happens after this point."""
+        return dict(self.seconds), self.episodes
+
+    def summary(self, since=None):
+        """One-line breakdown: milliseconds per episode and share of timed time for each phase."""
+        seconds, episodes = dict(self.seconds), self.episodes
+        if since is not None:
+            earlier, earlier_episodes = since
+            seconds = {phase: s - earlier.get(phase, 0.0) for phase, s in seconds.items()}
+            episodes -= earlier_episodes
+        total = sum(seconds.values())
+        if not total or not episodes:
+            return "no timed phases"
+        parts = [f"{phase} {s / episodes * 1e3:.3f}ms {s / total:.0%}"
+                 for phase, s in sorted(seconds.items(), key=lambda item: -item[1])]
+        return f"{total / episodes * 1e3:.3f} ms/episode: " + ", ".join(parts)
+
+
+class SamplingProfiler:
+    """Statistical profiler: samples the main thread's stack every `interval` seconds of CPU time.
+
+    Uses SIGPROF, so it only works on Unix and from the main thread. dump()
+    writes collapsed stacks ("outer;inner count" per line), the input format
+    of flame graph tools such as flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = Counter()
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        self.samples[";".join(reversed(stack))] += 1
+
+    def enable(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def dump_stats(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class EpisodeProfiler:
+    """Profiles the episodes in [start, stop) and writes the result to path when the range ends.
+
+    mode "cprofile" writes a pstats file (python -m pstats PATH, or
+    snakeviz); "sample" writes collapsed stacks from SamplingProfiler.
+    """
+
+    def __init__(self, start, stop, path, mode="cprofile"):
+        if mode not in ("cprofile", "sample"):
+            raise ValueError(f"unknown profile mode {mode!r}")
+        if mode == "sample" and not hasattr(signal, "setitimer"):
+            raise ValueError("sampling needs signal.setitimer, which this platform lacks")
+        self.start = start
+        self.stop = stop
+        self.path = path
+        self.profiler = cProfile.Profile() if mode == "cprofile" else SamplingProfiler()
+        self.active = False
+
+    def before_episode(self, episode):
+        if episode == self.start:
+            self.profiler.enable()
+            self.active = True
+
+    def after_episode(self, episode):
+        if self.active and episode + 1 >= self.stop:
+            self.close()
+
+    def close(self):
+        """Stop profiling early (e.g. training ended inside the range) and write what was collected."""
+        if self.active:
+            self.profiler.disable()
+            self.active = False
+            self.profiler.dump_stats(self.path)
+            print(f"Profile of episodes {self.start}-{self.stop - 1} written to {self.path}")
@@ -0,0 +1,227 @@
+import pickle
+import struct
+import sys
+import time
+from collections.abc import Mapping
+import numpy as np
+from persistence import atomic_write
+from state_keys import migrate_q_table
+
+Q_STORE_PATH = "q_table_agent.qtab"
+
+# File layout: 48-byte header, then n_states int64 keys sorted ascending, then
+# an (n_states, n_actions) float32 value matrix. Both arrays can be memory-mapped.
+# Version 1 files have a 32-byte header without the board fields.
+MAGIC = b"QTAB"
+VERSION = 2
+HEADER = struct.Struct("<4sIQQQ")  # magic, version, n_states, n_actions, flags
+BOARD = struct.Struct("<IIII")  # grid_size, lifespan_x, lifespan_o, win_length (all 0 if unknown)
+FLAG_CANONICAL = 1  # Keys are symmetry-canonical (see symmetry.py)
+INT64_MAX = 2 ** 63 - 1
+
+
+class DenseQTable(Mapping):
+    """Q-table backed by one contiguous float32 (n_states, n_actions) array.
+
+    Behaves like the dict it replaces: table[key] returns a writable row view,
+    table[key] = values sets a row and get()/in/len/items work as usual. A
+    table opened from a file looks keys up by binary search in the
+    memory-mapped key array; the first insert of a new key copies it into
+    memory and switches to a dict index. `board` is the (grid_size,
+    lifespan_x, lifespan_o, win_length) the keys were built for, or None if
+    unknown.
+    """
+    board = None  # Class default for tables pickled before the board was recorded
+
+    def __init__(self, n_actions=9, capacity=1024, board=None):
+        self.n_actions = n_actions
+        self.values = np.zeros((capacity, n_actions), dtype=np.float32)
+        self.index = {}
+        self.size = 0
+        self.canonical = False
+        self.board = board
+        self._sorted_keys = None
+
+    @classmethod
+    def from_dict(cls, q_table, n_actions=9, board=None):
+        """Build a dense table from a {state_key: q_values} mapping."""
+        table = cls(n_actions, capacity=max(1, len(q_table)), board=board)
+        for key, values in q_table.items():
+            table[key] = values
+        return table
+
+    @classmethod
+    def open(cls, path=Q_STORE_PATH, mode="r"):
+        """Memory-map a saved table without reading it into memory.
+
+        mode "r" is read-only and can be shared by several processes; "c" is
+        copy-on-write, so updates stay local to this process.
+        """
+        with open(path, "rb") as f:
+            magic, version, n_states, n_actions, flags = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version not in (1, VERSION):
+                raise ValueError(f"{path} is not a Q-store file")
+            board = BOARD.unpack(f.read(BOARD.size)) if version == VERSION else (0,) * 4
+        offset = HEADER.size + (BOARD.size if version == VERSION else 0)
+        table = cls(n_actions, capacity=0, board=board if any(board) else None)
+        table.index = None
+        table.size = n_states
+        table.canonical = bool(flags & FLAG_CANONICAL)
+        if n_states:
+            table._sorted_keys = np.memmap(path, dtype=np.int64, mode=mode, offset=offset, shape=(n_states,))
+            table.values = np.memmap(path, dtype=np.float32, mode=mode, offset=offset + 8 * n_states,
+                                     shape=(n_states, n_actions))
+        else:
+            table._sorted_keys = np.zeros(0, dtype=np.int64)
+        return table
+
+    def save(self, path=Q_STORE_PATH):
+        """Write the table atomically in the memory-mappable format."""
+        if self.index is not None and any(not 0 <= key <= INT64_MAX for key in self.index):
+            raise ValueError("state keys do not fit the Q-store's int64 key column; "
+                             "checkpoint tables for boards this large to a .pkl path instead")
+        keys = np.fromiter(self, dtype=np.int64, count=self.size) if self.size else np.zeros(0, dtype=np.int64)
+        rows = np.fromiter((self._row(key) for key in keys.tolist()), dtype=np.int64, count=self.size)
+        order = np.argsort(keys, kind="stable")
+
+        def write(f):
+            flags = FLAG_CANONICAL if self.canonical else 0
+            f.write(HEADER.pack(MAGIC, VERSION, self.size, self.n_actions, flags))
+            f.write(BOARD.pack(*(self.board or (0,) * 4)))
+            keys[order].tofile(f)
+            np.ascontiguousarray(self.values[rows[order]], dtype=np.float32).tofile(f)
+
+        atomic_write(path, write)
+
+    def board_mismatch(self, grid_size, lifespan_x, lifespan_o, win_length):
+        """Why the table cannot be used on this board, or None if it can.
+
+        Tables that do not record their board are only checked for the board size.
+        """
+        board = (grid_size, lifespan_x, lifespan_o, win_length)
+        if self.n_actions != grid_size * grid_size:
+            return f"Q-table has {self.n_actions} actions, but a {grid_size}x{grid_size} board has {grid_size ** 2}"
+        if self.board is not None and tuple(self.board) != board:
+            return ("Q-table was trained for (grid size, lifespan X, lifespan O, win length) = "
+                    f"{tuple(self.board)}, not {board}")
+        return None
+
+    def _row(self, key):
+        """Row index of key, or None if the table does not hold it."""
+        if self.index is not None:
+            return self.index.get(key)
+        if not 0 <= key <= INT64_MAX:
+            return None
+        i = int(np.searchsorted(self._sorted_keys, key))
+        if i < self.size and self._sorted_keys[i] == key:
+            return i
+        return None
+
+    def _materialize(self):
+        """Switch a file-backed table to an in-memory dict index before inserting."""
+        keys = self._sorted_keys.tolist()
+        self.index = dict(zip(keys, range(len(keys))))
+        self.values = np.array(self.values, dtype=np.float32).reshape(-1, self.n_actions)
+        self._sorted_keys = None
+
+    def _reserve(self, n_states):
+        """Grow the value array (at least doubling) so it can hold n_states rows."""
+        if n_states > len(self.values):
+            grown = np.zeros((max(1024, 2 * len(self.values), n_states), self.n_actions), dtype=np.float32)
+            grown[:self.size] = self.values[:self.size]
+            self.values = grown
+
+    def __getitem__(self, key):
+        row = self._row(key)
+        if row is None:
+            raise KeyError(key)
+        return self.values[row]
+
+    def __setitem__(self, key, values):
+        row = self._row(key)
+        if row is None:
+            if self.index is None:
+                self._materialize()
+            self._reserve(self.size + 1)
+            row = self.size
+            self.index[key] = row
+            self.size += 1
+        self.values[row] = values
+
+    def rows_for(self, keys):
+        """Row index for each of the (distinct) keys, inserting zero rows for keys not yet in the table."""
+        if self.index is None:
+            rows = [self._row(key) for key in keys]
+            if None not in rows:
+                return np.array(rows, dtype=np.int64)
+            self._materialize()
+        get = self.index.get
+        rows = [get(key, -1) for key in keys]
+        missing = [key for key, row in zip(keys, rows) if row < 0]
+        if missing:
+            self._reserve(self.size + len(missing))
+            self.values[self.size:self.size + len(missing)] = 0
+            self.index.update(zip(missing, range(self.size, self.size + len(missing))))
+            self.size += len(missing)
+            rows = [get(key) for key in keys]
+        return np.array(rows, dtype=np.int64)
+
+    def copy(self):
+        """In-memory copy of the table, e.g. to save it while the original keeps changing."""
+        table = DenseQTable(self.n_actions, capacity=0, board=self.board)
+        if self.index is None:
+            table.index = dict(zip(self._sorted_keys.tolist(), range(self.size)))
+        else:
+            table.index = dict(self.index)
+        table.values = np.array(self.values[:self.size], dtype=np.float32).reshape(-1, self.n_actions)
+        table.size = self.size
+        table.canonical = self.canonical
+        return table
+
+    def get(self, key, default=None):
+        row = self._row(key)
+        return default if row is None else self.values[row]
+
+    def __contains__(self, key):
+        return self._row(key) is not None
+
+    def __iter__(self):
+        if self.index is not None:
+            return iter(self.index)
+        return iter(self._sorted_keys.tolist())
+
+    def __len__(self):
+        return self.size
+
+    def nbytes(self):
+        """Bytes held by the value array and key index."""
+        if self.index is None:
+            return self.values.nbytes + self._sorted_keys.nbytes
+        return self.values.nbytes + sys.getsizeof(self.index) + sum(sys.getsizeof(k) for k in self.index)
+
+
+def dict_nbytes(q_table):
+    """Approximate bytes held by a {state_key: ndarray} Q-table."""
+    return sys.getsizeof(q_table) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in q_table.items())
+
+
+def convert_pickle(pickle_path="q_table_agent.pkl", store_path=Q_STORE_PATH):
+    """Convert a pickled Q-table (old or integer keys) into the Q-store format and report the savings."""
+    start = time.perf_counter()
+    with open(pickle_path, "rb") as f:
+        q_table = migrate_q_table(pickle.load(f))
+    pickle_load = time.perf_counter() - start
+
+    DenseQTable.from_dict(q_table).save(store_path)
+    start = time.perf_counter()
+    table = DenseQTable.open(store_path)
+    store_load = time.perf_counter() - start
+
+    print(f"States: {len(q_table)}")
+    print(f"Pickle:  {dict_nbytes(q_table) / 1024:,.1f} KiB in memory, loaded in {pickle_load * 1000:.2f} ms")
+    print(f"Q-store: {table.nbytes() / 1024:,.1f} KiB mapped, opened in {store_load * 1000:.2f} ms")
+    return table
+
+
+if __name__ == "__main__":
+    convert_pickle(*sys.argv[1:3])
@@ -0,0 +1,94 @@
+import os
+from collections import namedtuple
+import numpy as np
+
+PLAYER_CODES = {"X": 1, "O": -1}
+
+COLUMNS = {
+    "states": np.int64,       # state key before the move (StateEncoder)
+    "actions": np.int16,
+    "rewards": np.float32,
+    "next_states": np.int64,  # state key after the move
+    "dones": np.bool_,
+    "players": np.int8,       # env.current_player after the move: 1 = X, -1 = O
+    "steps": np.int16,        # index of the transition within its episode
+}
+
+Transitions = namedtuple("Transitions", list(COLUMNS))
+
+
+class ReplayBuffer:
+    """Preallocated ring buffer of transitions stored as fixed-dtype columns.
+
+    Positions are absolute: `total` counts every transition ever added and
+    view(start, stop) returns the columns for that range, as views when it
+    does not wrap around the end of the ring. Pass the encoder's key_dtype
+    for boards whose state keys do not fit in int64.
+    """
+
+    def __init__(self, capacity=100000, key_dtype=np.int64):
+        self.capacity = capacity
+        self.columns = {name: np.zeros(capacity, dtype=key_dtype if name.endswith("states") else dtype)
+                        for name, dtype in COLUMNS.items()}
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def add(self, state, action, reward, next_state, done, player, step):
+        """Append one transition, overwriting the oldest once the buffer is full."""
+        i = self.total % self.capacity
+        columns = self.columns
+        columns["states"][i] = state
+        columns["actions"][i] = action
+        columns["rewards"][i] = reward
+        columns["next_states"][i] = next_state
+        columns["dones"][i] = done
+        columns["players"][i] = PLAYER_CODES[player]
+        columns["steps"][i] = step
+        self.total += 1
+
+    def view(self, start=None, stop=None):
+        """Transitions in [start, stop) (default: everything still held), oldest first."""
+        stop = self.total if stop is None else stop
+        start = max(0, self.total - self.capacity) if start is None else start
+        if start < self.total - self.capacity or stop > self.total or start > stop:
+            raise IndexError(f"transitions {start}:{stop} are not in the buffer")
+        lo = start % self.capacity
+        hi = lo + stop - start
+        if hi <= self.capacity:
+            return Transitions(*(column[lo:hi] for column in self.columns.values()))
+        hi -= self.capacity
+        return Transitions(*(np.concatenate((column[lo:], column[:hi])) for column in self.columns.values()))
+
+    def save(self, path):
+        """Save the held transitions, oldest first, to an .npz file."""
+        np.savez(path, **self.view()._asdict())
+
+    def save_columns(self, directory):
+        """Save each column as a .npy file that load_columns can memory-map."""
+        os.makedirs(directory, exist_ok=True)
+        for name, column in self.view()._asdict().items():
+            np.save(os.path.join(directory, name + ".npy"), column)
+
+    @classmethod
+    def load(cls, path, capacity=None):
+        """Load an .npz file written by save() into a new buffer."""
+        with np.load(path) as data:
+            return cls._from_columns({name: data[name] for name in COLUMNS}, capacity)
+
+    @staticmethod
+    def load_columns(directory, mmap_mode="r"):
+        """Memory-map the columns written by save_columns() as read-only Transitions."""
+        return Transitions(*(np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+                             for name in COLUMNS))
+
+    @classmethod
+    def _from_columns(cls, columns, capacity):
+        size = len(columns["states"])
+        buffer = cls(capacity or max(1, size), columns["states"].dtype)
+        keep = min(size, buffer.capacity)
+        for name, column in columns.items():
+            buffer.columns[name][:keep] = column[size - keep:]
+        buffer.total = keep
+        return buffer
@@ -0,0 +1,268 @@
+import os
+from collections import deque
+import numpy as np
+from bitboard_env import build_line_masks
+from persistence import atomic_write
+from state_keys import get_encoder
+
+SOLVER_CACHE_DIR = "solver_cache"
+
+WIN, DRAW, LOSS = 1, 0, -1
+
+
+class EphemeralSolver:
+    """Exact game-theoretic solution of Ephemeral Tic-Tac-Toe by retrograde analysis.
+
+    Values are from the point of view of the player to move: WIN, DRAW or LOSS
+    under perfect play, ignoring reward shaping. Expiring pieces make the state
+    graph cyclic, so values are propagated backwards from positions with an
+    immediate win; states never decided that way can be held to a draw forever.
+    depth is the number of plies until the game ends (shortest win, longest loss).
+
+    Internally a state is the player to move plus, for each age, the cell of
+    the piece with that age (or -1). Every move ages all pieces by one, so ages
+    on the board are distinct and the owner of age a follows from its parity:
+    even ages belong to the player who just moved.
+    """
+
+    def __init__(self, grid_size=3, lifespan_x=6, lifespan_o=6, cache_dir=SOLVER_CACHE_DIR, win_length=3):
+        self.grid_size = grid_size
+        self.lifespan_x = lifespan_x
+        self.lifespan_o = lifespan_o
+        self.win_length = win_length
+        self.n_cells = grid_size * grid_size
+        self.max_age = max(lifespan_x, lifespan_o)
+        self.encoder = get_encoder(grid_size, lifespan_x, lifespan_o)
+        self.line_masks = build_line_masks(grid_size, win_length)
+        self.cell_lines = [[m for m in self.line_masks if m >> c & 1] for c in range(self.n_cells)]
+        self.cache_dir = cache_dir
+        self.index = {}
+        self.values = None
+        self.depths = None
+
+    @property
+    def cache_path(self):
+        name = f"solve_g{self.grid_size}_x{self.lifespan_x}_o{self.lifespan_o}.npz"
+        if self.win_length != 3:
+            name = name.replace(".npz", f"_k{self.win_length}.npz")
+        return os.path.join(self.cache_dir, name)
+
+    def solve(self):
+        """Load the solution from the disk cache, or compute and cache it."""
+        if self.cache_dir and os.path.exists(self.cache_path):
+            data = np.load(self.cache_path)
+            keys, self.values, self.depths = data["keys"], data["values"], data["depths"]
+        else:
+            keys = self._retrograde()
+            if self.cache_dir:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                atomic_write(self.cache_path,
+                             lambda f: np.savez(f, keys=keys, values=self.values, depths=self.depths))
+        self.index = dict(zip(keys.tolist(), range(len(keys))))
+        return self
+
+    def _owner(self, mover, age):
+        """Owner of the piece with `age` when `mover` (0 = X, 1 = O) is to move."""
+        last_mover = 1 - mover
+        return "XO"[last_mover if age % 2 == 0 else mover]
+
+    def _lifespan(self, mover, age):
+        return self.lifespan_x if self._owner(mover, age) == "X" else self.lifespan_o
+
+    def _key(self, mover, cells):
+        """Solver key: env state key times two plus the player to move."""
+        key = 0
+        for age, cell in enumerate(cells):
+            if cell >= 0:
+                key += self.encoder.cell_digit(self._owner(mover, age), age) * self.encoder.powers[cell]
+        return key * 2 + mover
+
+    def _cells_from_key(self, key):
+        """Inverse of _key: (mover, per-age cell tuple)."""
+        owners, ages = self.encoder.decode(key // 2)
+        cells = [-1] * self.max_age
+        for cell, owner in enumerate(owners):
+            if owner is not None:
+                cells[ages[cell]] = cell
+        return key % 2, tuple(cells)
+
+    def _moves(self, mover, cells):
+        """Yield (action, outcome, next_cells) with outcome "win", "draw" or None for a non-terminal move."""
+        occupied = 0
+        for cell in cells:
+            if cell >= 0:
+                occupied |= 1 << cell
+        aged = []
+        for age in range(self.max_age - 1):
+            cell = cells[age]
+            aged.append(cell if cell >= 0 and age + 1 < self._lifespan(mover, age) else -1)
+        for action in range(self.n_cells):
+            if occupied >> action & 1:
+                continue
+            next_cells = (action,) + tuple(aged)
+            mine = 0
+            taken = 0
+            for age, cell in enumerate(next_cells):
+                if cell >= 0:
+                    taken |= 1 << cell
+                    if age % 2 == 0:
+                        mine |= 1 << cell
+            if any(mine & mask == mask for mask in self.cell_lines[action]):
+                yield action, "win", next_cells
+            elif taken == (1 << self.n_cells) - 1:
+                yield action, "draw", next_cells
+            else:
+                yield action, None, next_cells
+
+    def _retrograde(self):
+        """Enumerate reachable states and propagate wins and losses backwards; return sorted keys."""
+        empty = (-1,) * self.max_age
+        ids = {}
+        states = []
+        for mover in (0, 1):
+            ids[(mover, empty)] = len(states)
+            states.append((mover, empty))
+        successors = []
+        wins_now = []
+        draw_exit = []
+        i = 0
+        while i < len(states):
+            mover, cells = states[i]
+            succ = []
+            win = draw = False
+            for _, outcome, next_cells in self._moves(mover, cells):
+                if outcome == "win":
+                    win = True
+                elif outcome == "draw":
+                    draw = True
+                else:
+                    state = (1 - mover, next_cells)
+                    if state not in ids:
+                        ids[state] = len(states)
+                        states.append(state)
+                    succ.append(ids[state])
+            successors.append(succ)
+            wins_now.append(win)
+            draw_exit.append(draw)
+            i += 1
+
+        n = len(states)
+        predecessors = [[] for _ in range(n)]
+        for s, succ in enumerate(successors):
+            for t in succ:
+                predecessors[t].append(s)
+        values = np.zeros(n, dtype=np.int8)
+        depths = np.zeros(n, dtype=np.int16)
+        remaining = [len(succ) for succ in successors]
+        queue = deque()
+        for s in range(n):
+            if wins_now[s]:
+                values[s], depths[s] = WIN, 1
+                queue.append(s)
+        # FIFO order decides states by increasing depth, so wins get the
+        # shortest and losses the longest distance to the end of the game.
+        while queue:
+            s = queue.popleft()
+            for p in predecessors[s]:
+                if values[p] or wins_now[p]:
+                    continue
+                if values[s] == LOSS:
+                    values[p], depths[p] = WIN, depths[s] + 1
+                    queue.append(p)
+                else:
+                    remaining[p] -= 1
+                    if remaining[p] == 0 and not draw_exit[p]:
+                        values[p], depths[p] = LOSS, depths[s] + 1
+                        queue.append(p)
+
+        keys = np.array([self._key(mover, cells) for mover, cells in states], dtype=np.int64)
+        order = np.argsort(keys)
+        self.values, self.depths = values[order], depths[order]
+        return keys[order]
+
+    def _env_key(self, env):
+        return env.state_key() * 2 + (0 if env.current_player == "X" else 1)
+
+    def value(self, env):
+        """(value, depth) for the player to move in env's current state."""
+        row = self.index[self._env_key(env)]
+        return int(self.values[row]), int(self.depths[row])
+
+    def move_values(self, env):
+        """Map each legal action to its (value, depth) for the player to move."""
+        return self._move_values(*self._cells_from_key(self._env_key(env)))
+
+    def _move_values(self, mover, cells):
+        result = {}
+        for action, outcome, next_cells in self._moves(mover, cells):
+            if outcome == "win":
+                result[action] = (WIN, 1)
+            elif outcome == "draw":
+                result[action] = (DRAW, 0)
+            else:
+                row = self.index[self._key(1 - mover, next_cells)]
+                result[action] = (-int(self.values[row]), int(self.depths[row]) + 1)
+        return result
+
+    def best_actions(self, env):
+        """All legal actions that keep the best value, preferring quick wins and slow losses."""
+        move_values = self.move_values(env)
+        if not move_values:
+            return []
+
+        def rank(item):
+            value, depth = item[1]
+            return (value, -depth if value == WIN else depth if value == LOSS else 0)
+
+        best = max(rank(item) for item in move_values.items())
+        return [action for action, vd in move_values.items() if rank((action, vd)) == best]
+
+
+class PerfectPlayer:
+    """Player that always picks a game-theoretically optimal move."""
+    def __init__(self, solver=None):
+        self.solver = solver or EphemeralSolver().solve()
+
+    def select_action(self, env, obs, q_table=None):
+        best = self.solver.best_actions(env)
+        return best[0] if best else None
+
+
+def score_q_table(q_table, solver, player="X", symmetry=None):
+    """Fraction of `player`'s solved states where the greedy Q-table move keeps the optimal value.
+
+    Only states present in the Q-table are scored; returns (accuracy, states scored).
+    Pass a Symmetry for tables keyed by canonical states.
+    """
+    mover = 0 if player == "X" else 1
+    correct = scored = 0
+    for key in solver.index:
+        if key % 2 != mover:
+            continue
+        if symmetry is None:
+            q_values = q_table.get(key // 2)
+        else:
+            q_values = symmetry.q_values(q_table, key // 2)
+        if q_values is None:
+            continue
+        move_values = solver._move_values(*solver._cells_from_key(key))
+        action = max(move_values, key=lambda x: q_values[x])
+        scored += 1
+        correct += move_values[action][0] == max(v for v, _ in move_values.values())
+    return correct / max(1, scored), scored
+
+
+if __name__ == "__main__":
+    import time
+    from q_store import Q_STORE_PATH, DenseQTable
+    from symmetry import get_symmetry
+
+    start = time.perf_counter()
+    solver = EphemeralSolver().solve()
+    print(f"Solved {len(solver.index)} states in {time.perf_counter() - start:.2f}s")
+    print("States won/drawn/lost by the player to move:",
+          *(int((solver.values == v).sum()) for v in (WIN, DRAW, LOSS)))
+    if os.path.exists(Q_STORE_PATH):
+        q_table = DenseQTable.open(Q_STORE_PATH)
+        accuracy, scored = score_q_table(q_table, solver, symmetry=get_symmetry() if q_table.canonical else None)
+        print(f"Q-table agent (X) plays optimally in {accuracy:.1%} of {scored} known states")
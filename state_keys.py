@@ -0,0 +1,76 @@
+from functools import lru_cache
+import numpy as np
+
+
+class StateEncoder:
+    """Maps (board, ages, owners) to a single non-negative integer.
+
+    Each cell is one digit in base 1 + lifespan_x + lifespan_o: 0 for an empty
+    cell, 1 + age for an X piece and 1 + lifespan_x + age for an O piece. Pieces
+    never stay on the board at or past their lifespan, so every reachable state
+    has exactly one key and every key decodes back to its state.
+    """
+
+    def __init__(self, grid_size=3, lifespan_x=6, lifespan_o=6):
+        self.grid_size = grid_size
+        self.lifespan_x = lifespan_x
+        self.lifespan_o = lifespan_o
+        self.n_cells = grid_size * grid_size
+        self.base = 1 + lifespan_x + lifespan_o
+        self.powers = [self.base ** c for c in range(self.n_cells)]
+        # Keys of larger boards outgrow int64 and are kept as Python ints.
+        self.key_dtype = np.int64 if self.base ** self.n_cells <= 2 ** 63 else object
+
+    def cell_digit(self, owner, age):
+        """Digit for a cell holding `owner` ("X", "O" or None) at `age`."""
+        if owner is None:
+            return 0
+        return 1 + age if owner == "X" else 1 + self.lifespan_x + age
+
+    def from_observation(self, obs):
+        """Key for an observation as returned by the env."""
+        o_offset = 1 + self.lifespan_x
+        key = 0
+        for (owner, age, _), power in zip(obs.reshape(-1, 3).tolist(), self.powers):
+            if owner:
+                key += (1 + int(age) if owner > 0 else o_offset + int(age)) * power
+        return key
+
+    def from_legacy(self, legacy_key):
+        """Key for a (board string, ages string) tuple built by the old hash_state."""
+        board, ages = legacy_key
+        if len(board) != self.n_cells or len(ages) != self.n_cells:
+            raise ValueError(f"cannot parse legacy state key {legacy_key!r}")
+        return sum(self.cell_digit(None if b == " " else b, int(a)) * p for b, a, p in zip(board, ages, self.powers))
+
+    def decode(self, key):
+        """Return (owners, ages) lists in row-major order for a key."""
+        owners, ages = [], []
+        for _ in range(self.n_cells):
+            key, digit = divmod(key, self.base)
+            if digit == 0:
+                owners.append(None)
+                ages.append(0)
+            elif digit <= self.lifespan_x:
+                owners.append("X")
+                ages.append(digit - 1)
+            else:
+                owners.append("O")
+                ages.append(digit - 1 - self.lifespan_x)
+        return owners, ages
+
+
+@lru_cache(maxsize=None)
+def get_encoder(grid_size=3, lifespan_x=6, lifespan_o=6):
+    """Shared StateEncoder for a board configuration."""
+    return StateEncoder(grid_size, lifespan_x, lifespan_o)
+
+
+def migrate_q_table(q_table, encoder=None):
+    """Rekey a Q-table from legacy string-tuple keys to integer keys.
+
+    Integer keys are passed through untouched, so this is safe to call on any table.
+    """
+    encoder = encoder or get_encoder()
+    return {encoder.from_legacy(key) if isinstance(key, tuple) else key: values
+            for key, values in q_table.items()}
@@ -0,0 +1,102 @@
+from functools import lru_cache
+import numpy as np
+from q_store import DenseQTable
+from replay_buffer import Transitions
+from state_keys import get_encoder
+
+CACHE_LIMIT = 1000000  # Canonicalized state keys remembered per Symmetry
+
+
+def dihedral_permutations(grid_size):
+    """The 8 rotations/reflections of the board as cell permutations.
+
+    For a permutation p, the transformed board holds board[p[i]] in cell i.
+    """
+    idx = np.arange(grid_size * grid_size).reshape(grid_size, grid_size)
+    perms = [np.rot90(idx, k).ravel() for k in range(4)] + [np.rot90(idx.T, k).ravel() for k in range(4)]
+    return [p.tolist() for p in perms]
+
+
+class Symmetry:
+    """Maps states to one representative under the board's 8 symmetries.
+
+    The canonical key is the smallest key among the 8 transformed states. An
+    action a on the original board is action inverse[t][a] on the canonical
+    board, so a canonical Q-row gathered with inverse[t] is in the original
+    action order.
+    """
+
+    def __init__(self, grid_size=3, lifespan_x=6, lifespan_o=6):
+        self.encoder = get_encoder(grid_size, lifespan_x, lifespan_o)
+        self.perms = dihedral_permutations(grid_size)
+        self.inverse = [[p.index(a) for a in range(len(p))] for p in self.perms]
+        self.inverse_arrays = [np.array(inv) for inv in self.inverse]
+        self._cache = {}
+
+    def canonical(self, key):
+        """Return (canonical key, transform index) for a state key."""
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        base = self.encoder.base
+        digits = []
+        rest = key
+        for _ in range(self.encoder.n_cells):
+            rest, digit = divmod(rest, base)
+            digits.append(digit)
+        powers = self.encoder.powers
+        best = None
+        for t, perm in enumerate(self.perms):
+            transformed = sum(digits[src] * power for src, power in zip(perm, powers) if digits[src])
+            if best is None or transformed < best[0]:
+                best = (transformed, t)
+        if len(self._cache) >= CACHE_LIMIT:
+            self._cache.clear()
+        self._cache[key] = best
+        return best
+
+    def q_values(self, q_table, key, default=None):
+        """Q-values for the state key in original action order, or default if unseen."""
+        canonical_key, t = self.canonical(key)
+        row = q_table.get(canonical_key)
+        return default if row is None else row[self.inverse_arrays[t]]
+
+    def canonical_transitions(self, transitions):
+        """Copy of transitions with states, next states and actions in canonical form."""
+        states, actions, next_states = [], [], []
+        for state, action, next_state in zip(transitions.states.tolist(), transitions.actions.tolist(),
+                                             transitions.next_states.tolist()):
+            canonical_key, t = self.canonical(state)
+            states.append(canonical_key)
+            actions.append(self.inverse[t][action])
+            next_states.append(self.canonical(next_state)[0])
+        key_dtype = transitions.states.dtype
+        return Transitions(np.array(states, dtype=key_dtype), np.array(actions, dtype=transitions.actions.dtype),
+                           transitions.rewards, np.array(next_states, dtype=key_dtype), transitions.dones,
+                           transitions.players, transitions.steps)
+
+
+@lru_cache(maxsize=None)
+def get_symmetry(grid_size=3, lifespan_x=6, lifespan_o=6):
+    """Shared Symmetry for a board configuration."""
+    return Symmetry(grid_size, lifespan_x, lifespan_o)
+
+
+def canonicalize_q_table(q_table, symmetry):
+    """Fold a plain Q-table into canonical keys, averaging rows that land on the same state."""
+    sums, counts = {}, {}
+    for key in q_table:
+        canonical_key, t = symmetry.canonical(key)
+        values = np.zeros(len(q_table[key]), dtype=np.float64)
+        values[symmetry.inverse_arrays[t]] = q_table[key]
+        if canonical_key in sums:
+            sums[canonical_key] += values
+            counts[canonical_key] += 1
+        else:
+            sums[canonical_key] = values
+            counts[canonical_key] = 1
+    table = DenseQTable(symmetry.encoder.n_cells, capacity=max(1, len(sums)), board=getattr(q_table, "board", None))
+    for key, values in sums.items():
+        table[key] = values / counts[key]
+    table.canonical = True
+    return table
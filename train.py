@@ -1,66 +1,173 @@
 import numpy as np
-from collections import defaultdict
 import random
-import pickle
-from env import EphemeralTicTacToeEnv
-from visualization import Visualizer
-import pygame
+import time
+from bitboard_env import BitboardTicTacToeEnv
+from persistence import QTableCheckpointer, snapshot_path
+from profiling import EpisodeProfiler, PhaseTimer
+from q_store import Q_STORE_PATH, DenseQTable
+from state_keys import get_encoder
+from replay_buffer import PLAYER_CODES, ReplayBuffer
+from symmetry import get_symmetry
 
 # Configuration switches
 GUI = True  # Set to True to enable GUI during training
+GRID_SIZE = 3  # Board is GRID_SIZE x GRID_SIZE
+WIN_LENGTH = 3  # Pieces in a row needed to win
+LIFESPAN_X = 6  # Turns an X piece stays on the board
+LIFESPAN_O = 6  # Turns an O piece stays on the board
 EPISODES = 50000  # Number of training episodes
 VISUALIZE_EVERY = 1  # Visualize every N episodes if GUI is True
+RENDER_THREAD = False  # Draw on a separate thread without pausing between moves, so the GUI never slows training
+CHECKPOINT_EVERY = 5000  # Save the Q-table every N episodes (None to save only at the end)
+REPLAY_CAPACITY = 100000  # Most recent transitions kept in the replay buffer
+SYMMETRY = True  # Share Q-values between rotated/reflected boards
+UPDATE_EVERY = 1  # Episodes per Q-update; above 1, updates are batched with batch_update_q_table
+REPLAY_PATH = None  # Set to e.g. "replay.npz" to save the replay buffer after training
+PROFILE = False  # Time each training phase and print the breakdown with the progress line
+PROFILE_EPISODES = None  # e.g. (1000, 1100) to profile those episodes and write PROFILE_PATH
+PROFILE_MODE = "cprofile"  # "cprofile" for a pstats file, "sample" for collapsed stacks (flame graphs)
+PROFILE_PATH = "train.prof"
 
-def hash_state(obs):
-    """Convert observation to a hashable state."""
-    board_channel = obs[:, :, 0]
-    ages_channel = obs[:, :, 1]
-    return (''.join("X" if x == 1 else "O" if x == -1 else " " for x in board_channel.flatten()),
-            ''.join(map(str, ages_channel.flatten().astype(int))))
-
-def train_against_random(episodes=EPISODES, gamma=0.95, epsilon=1.0, decay_rate=0.9995, gui=GUI, visualize_every=VISUALIZE_EVERY):
-    """Train a Q-learning agent against random moves."""
-    env = EphemeralTicTacToeEnv()
-    visualizer = Visualizer(gui=gui)
-    q_table = defaultdict(lambda: np.zeros(9))
+def hash_state(obs, lifespan_x=LIFESPAN_X, lifespan_o=LIFESPAN_O):
+    """Convert observation to an integer state key (see state_keys.StateEncoder), by default for the configured lifespans."""
+    return get_encoder(obs.shape[0], lifespan_x, lifespan_o).from_observation(obs)
+
+class HeadlessRenderer:
+    """Renderer used when gui is off: no hooks, and pygame is never imported."""
+    def step_hook(self, episode):
+        return None
+
+    def end_episode(self, episode):
+        pass
+
+    def close(self):
+        pass
+
+def announce_snapshot_path(path, encoder):
+    """snapshot_path() for the board's keys, saying so when it differs from the requested path."""
+    new_path = snapshot_path(path, encoder)
+    if new_path != path:
+        print(f"State keys of a {encoder.grid_size}x{encoder.grid_size} board do not fit {path}; "
+              f"saving the Q-table to {new_path} instead")
+    return new_path
+
+def make_renderer(env, visualize_every, threaded=False):
+    """Import pygame and the visualizer only when training is actually rendered."""
+    from visualization import TrainingRenderer
+    return TrainingRenderer(env, visualize_every, threaded)
+
+def play_episode(env, q_table, epsilon, buffer, max_steps=40, on_step=None, symmetry=None, stats=None):
+    """Play one epsilon-greedy agent (X) vs random (O) game, recording it into buffer.
+
+    Returns (game_history, last reward, done, last info), where game_history
+    is the buffer's view of this episode's transitions; on_step is called with
+    each step's result, e.g. to render it. With a Symmetry, q_table is keyed
+    by canonical states. A PhaseTimer in stats is charged for action
+    selection, env steps, state keys, recording and rendering.
+    """
+    timed = stats is not None
+    if timed:
+        t = time.perf_counter()
+    env.reset(starting_player="X")  # Agent as X
+    start = buffer.total
+    done = False
+    reward, info = 0, {}
+    step_count = 0
+    state_key = env.state_key()
+    if timed:
+        t = stats.lap("env", t)
+
+    while not done and step_count < max_steps:
+        legal_actions = env.get_legal_actions()
+        if not legal_actions:
+            break
+
+        if env.current_player == "X":  # Agent's turn
+            if random.random() < epsilon:
+                action = random.choice(legal_actions)
+            else:
+                if symmetry is None:
+                    q_values = q_table.get(state_key, np.zeros(env.n_cells))
+                else:
+                    q_values = symmetry.q_values(q_table, state_key, np.zeros(env.n_cells))
+                action = max(legal_actions, key=lambda x: q_values[x])
+        else:  # Random player's turn
+            action = random.choice(legal_actions)
+        if timed:
+            t = stats.lap("select", t)
+
+        if on_step is None:  # Nothing to draw, so skip building the observation
+            next_state_key, reward, done, info = env.step_key(action)
+            if timed:
+                t = stats.lap("env", t)
+        else:
+            next_obs, reward, done, info = env.step(action)
+            if timed:
+                t = stats.lap("env", t)
+            next_state_key = env.state_key()
+            if timed:
+                t = stats.lap("state_key", t)
+        buffer.add(state_key, action, reward, next_state_key, done, env.current_player, step_count)
+        if timed:
+            t = stats.lap("record", t)
+        if on_step is not None:
+            on_step(next_obs, reward, done, info)
+            if timed:
+                t = stats.lap("render", t)
+        state_key = next_state_key
+        step_count += 1
+
+    if timed:
+        stats.episodes += 1
+    return buffer.view(start, buffer.total), reward, done, info
+
+def train_against_random(episodes=EPISODES, gamma=0.95, epsilon=1.0, decay_rate=0.9995, gui=GUI, visualize_every=VISUALIZE_EVERY, checkpoint_every=CHECKPOINT_EVERY, q_table_path=Q_STORE_PATH, replay_path=REPLAY_PATH, update_every=UPDATE_EVERY,
+                         use_symmetry=SYMMETRY, grid_size=GRID_SIZE, win_length=WIN_LENGTH, lifespan_x=LIFESPAN_X,
+                         lifespan_o=LIFESPAN_O, profile=PROFILE, stats=None, profile_episodes=PROFILE_EPISODES, profile_mode=PROFILE_MODE,
+                         profile_path=PROFILE_PATH, render_thread=RENDER_THREAD):
+    """Train a Q-learning agent against random moves.
+
+    Boards from 5x5 up have state keys beyond int64, which the .qtab format
+    cannot hold, so their table is saved under the .pkl name instead. With profile set (or a
+    PhaseTimer passed as stats, to read it afterwards) each phase is timed
+    and the last 100 episodes' breakdown is printed with the progress line.
+    profile_episodes=(start, stop) profiles those episodes into profile_path.
+    """
+    if profile and stats is None:
+        stats = PhaseTimer()
+    timed = stats is not None
+    profiler = EpisodeProfiler(*profile_episodes, profile_path, profile_mode) if profile_episodes else None
+    env = BitboardTicTacToeEnv(grid_size, lifespan_x, lifespan_o, win_length=win_length)
+    q_table_path = announce_snapshot_path(q_table_path, env.encoder)
+    renderer = make_renderer(env, visualize_every, render_thread) if gui else HeadlessRenderer()
+    symmetry = get_symmetry(env.grid_size, env.lifespan_x, env.lifespan_o) if use_symmetry else None
+    q_table = DenseQTable(env.n_cells, board=(grid_size, lifespan_x, lifespan_o, win_length))
+    q_table.canonical = use_symmetry
+    checkpointer = QTableCheckpointer(q_table_path, every_episodes=checkpoint_every)
     total_wins = {"Agent": 0, "Random": 0, "Draw": 0}
+    buffer = ReplayBuffer(REPLAY_CAPACITY, env.encoder.key_dtype)
     max_steps = 40
-    game_history = []
+    if buffer.capacity < max_steps:
+        raise ValueError(f"REPLAY_CAPACITY must hold at least one episode ({max_steps} transitions)")
+    game_history = None
+    batch_start = 0
+    window = stats.snapshot() if timed else None
 
     for episode in range(episodes):
         current_epsilon = epsilon * (decay_rate ** episode)
         if episode % 100 == 0 or episode == 0:
-            avg_reward = sum([r for _, _, r, _, _, _ in game_history]) / max(1, len(game_history)) if game_history else 0
-            print(f"Episode: {episode}/{episodes}, Avg Reward: {avg_reward:.3f}, Epsilon: {current_epsilon:.3f}")
-
-        obs = env.reset(starting_player="X")  # Agent as X
-        done = False
-        step_count = 0
-        visualize = gui and (episode % visualize_every == 0)
-        game_history = []
-
-        while not done and step_count < max_steps:
-            legal_actions = env.get_legal_actions()
-            if not legal_actions:
-                break
-
-            if env.current_player == "X":  # Agent's turn
-                state_key = hash_state(obs)
-                if random.random() < current_epsilon:
-                    action = random.choice(legal_actions)
-                else:
-                    q_values = q_table.get(state_key, np.zeros(9))
-                    action = max(legal_actions, key=lambda x: q_values[x])
-            else:  # Random player's turn
-                action = random.choice(legal_actions)
+            avg_reward = float(game_history.rewards.mean()) if game_history is not None and len(game_history.rewards) else 0
+            print(f"Episode: {episode}/{episodes}, Avg Reward: {avg_reward:.3f}, Epsilon: {current_epsilon:.3f}"
+                  + (f", Time: {stats.summary(window)}" if timed and episode else ""))
+            if timed:
+                window = stats.snapshot()
+        if profiler is not None:
+            profiler.before_episode(episode)
 
-            next_obs, reward, done, info = env.step(action)
-            game_history.append((obs.copy(), action, reward, next_obs.copy(), done, env.current_player))
-            if visualize:
-                visualizer.refresh(next_obs, reward, done, info, env, [None, None, None])
-                pygame.time.wait(500)
-            obs = next_obs
-            step_count += 1
+        game_history, reward, done, info = play_episode(env, q_table, current_epsilon, buffer, max_steps,
+                                                        renderer.step_hook(episode), symmetry, stats)
+        if timed:
+            t = time.perf_counter()
 
         if done and reward == 1:
             winner = info["player"]
@@ -68,53 +175,149 @@ def train_against_random(episodes=EPISODES, gamma=0.95, epsilon=1.0, decay_rate=
         elif done:
             total_wins["Draw"] += 1
 
-        update_q_table(game_history, q_table, alpha=0.5, gamma=gamma)
+        if update_every == 1:
+            update_q_table(game_history, q_table, alpha=0.5, gamma=gamma, checkpointer=checkpointer,
+                           symmetry=symmetry)
+        # A batch is also applied early if the next episode could overwrite its oldest transitions
+        elif ((episode + 1) % update_every == 0 or episode == episodes - 1
+              or buffer.total - batch_start + max_steps > buffer.capacity):
+            batch_update_q_table(buffer.view(batch_start, buffer.total), q_table, alpha=0.5, gamma=gamma,
+                                 checkpointer=checkpointer, symmetry=symmetry)
+            batch_start = buffer.total
+        if timed:
+            t = stats.lap("update", t)
+        checkpointer.maybe_save(q_table, episode)
+        if timed:
+            t = stats.lap("checkpoint", t)
 
-        if gui:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    raise SystemExit
-            if visualize:
-                pygame.display.flip()
-                pygame.time.wait(1000)
+        renderer.end_episode(episode)
+        if timed:
+            stats.lap("render", t)
+        if profiler is not None:
+            profiler.after_episode(episode)
 
+    if profiler is not None:
+        profiler.close()
     print(f"\nTraining Complete!")
     print(f"Total Wins - Agent: {total_wins['Agent']}, Random: {total_wins['Random']}, Draw: {total_wins['Draw']}")
+    if timed:
+        print(f"Time: {stats.summary()}")
 
-    with open("q_table_agent.pkl", "wb") as f:
-        pickle.dump(dict(q_table), f)
-
-    if gui:
-        pygame.quit()
+    checkpointer.compact(q_table)
+    if replay_path:
+        buffer.save(replay_path)
+    renderer.close()
 
     return q_table
 
-def update_q_table(game_history, q_table, alpha=0.5, gamma=0.95):
-    """Update Q-table with adjusted rewards and decaying learning rate."""
-    for i, (state, action, reward, next_state, done, player) in enumerate(game_history):
-        if player != "X":  # Only update for agent's moves
+def update_q_table(game_history, q_table, alpha=0.5, gamma=0.95, checkpointer=None, symmetry=None):
+    """Update Q-table with adjusted rewards and decaying learning rate.
+
+    game_history holds one episode's Transitions, e.g. a ReplayBuffer view.
+    With a Symmetry, states and actions are mapped to canonical form first.
+    Nothing is written to disk here; changed rows are reported to the
+    checkpointer, which decides when to persist them.
+    """
+    if not len(game_history.states):
+        return
+    if symmetry is not None:
+        game_history = symmetry.canonical_transitions(game_history)
+    last_player = game_history.players[-1]
+    for state_key, action, reward, next_state_key, done, player, step in zip(
+            *(column.tolist() for column in game_history)):
+        if player != PLAYER_CODES["X"]:  # Only update for agent's moves
             continue
-        state_key = hash_state(state)
-        next_state_key = hash_state(next_state)
-        current_alpha = alpha / (1 + 0.01 * i)
+        current_alpha = alpha / (1 + 0.01 * step)
 
         if state_key not in q_table:
-            q_table[state_key] = np.zeros(9)
+            q_table[state_key] = np.zeros(q_table.n_actions)
         if next_state_key not in q_table:
-            q_table[next_state_key] = np.zeros(9)
+            q_table[next_state_key] = np.zeros(q_table.n_actions)
 
         adjusted_reward = reward
-        if done and reward == 1 and player != game_history[-1][5]:
+        if done and reward == 1 and player != last_player:
             adjusted_reward = -1
 
         current_q = q_table[state_key][action]
         best_next_q = np.max(q_table[next_state_key]) if not done else 0
         new_q = (1 - current_alpha) * current_q + current_alpha * (adjusted_reward + gamma * best_next_q)
         q_table[state_key][action] = new_q
+        if checkpointer is not None:
+            checkpointer.mark(state_key)
+
+def batch_update_q_table(transitions, q_table, alpha=0.5, gamma=0.95, checkpointer=None, symmetry=None):
+    """Apply update_q_table's TD rule to the transitions of many episodes at once.
 
-    with open("q_table_agent.pkl", "wb") as f:
-        pickle.dump(dict(q_table), f)
+    transitions are whole episodes laid end to end (steps restart at 0 for
+    each one) and q_table must be a DenseQTable. The result matches running
+    update_q_table episode by episode: transitions are grouped into waves in
+    which no Q-value is written twice and none is read after an earlier
+    transition in the same wave would have changed it. Each wave is then one
+    gather, one row max and one scatter.
+    """
+    if not len(transitions.states):
+        return
+    if symmetry is not None:
+        transitions = symmetry.canonical_transitions(transitions)
+    states, actions, rewards, next_states, dones, players, steps = transitions
+    episode_ids = np.cumsum(steps == 0) - 1
+    last_index = np.append(np.flatnonzero(steps == 0)[1:], len(steps)) - 1
+    last_players = players[last_index][episode_ids]
+
+    agent = np.flatnonzero(players == PLAYER_CODES["X"])  # Only update for agent's moves
+    if not len(agent):
+        return
+    keys, inverse = np.unique(np.concatenate((states[agent], next_states[agent])), return_inverse=True)
+    key_rows = q_table.rows_for(keys.tolist())
+    state_rows = key_rows[inverse[:len(agent)]]
+    next_rows = key_rows[inverse[len(agent):]]
+    actions = actions[agent].astype(np.int64)
+    dones = dones[agent]
+
+    rewards = rewards[agent].copy()
+    rewards[dones & (rewards == 1) & (players[agent] != last_players[agent])] = -1
+    current_alpha = alpha / (1 + 0.01 * steps[agent])
+
+    waves = np.empty(len(agent), dtype=np.int64)
+    cell_wave, row_written, row_read = {}, {}, {}
+    for j, (row, action, next_row, done) in enumerate(zip(state_rows.tolist(), actions.tolist(),
+                                                          next_rows.tolist(), dones.tolist())):
+        cell = (row, action)
+        wave = max(cell_wave.get(cell, -1) + 1, row_read.get(row, 0))
+        if not done:
+            wave = max(wave, row_written.get(next_row, -1) + 1)
+            row_read[next_row] = max(row_read.get(next_row, 0), wave)
+        cell_wave[cell] = wave
+        row_written[row] = max(row_written.get(row, -1), wave)
+        waves[j] = wave
+
+    values = q_table.values
+    order = np.argsort(waves, kind="stable")
+    bounds = np.flatnonzero(np.diff(waves[order])) + 1
+    for idx in np.split(order, bounds):
+        rows, cols = state_rows[idx], actions[idx]
+        best_next_q = np.where(dones[idx], 0, values[next_rows[idx]].max(axis=1))
+        a = current_alpha[idx]
+        values[rows, cols] = (1 - a) * values[rows, cols] + a * (rewards[idx] + gamma * best_next_q)
+
+    if checkpointer is not None:
+        for key in np.unique(states[agent]).tolist():
+            checkpointer.mark(key)
+
+def train_from_replay(replay_path, q_table=None, alpha=0.5, gamma=0.95, passes=1, use_symmetry=SYMMETRY,
+                      grid_size=GRID_SIZE, lifespan_x=LIFESPAN_X, lifespan_o=LIFESPAN_O, win_length=WIN_LENGTH):
+    """Offline training: replay a buffer saved by train_against_random into a Q-table."""
+    if q_table is None:
+        q_table = DenseQTable(grid_size * grid_size, board=(grid_size, lifespan_x, lifespan_o, win_length))
+        q_table.canonical = use_symmetry
+    symmetry = get_symmetry(grid_size, lifespan_x, lifespan_o) if use_symmetry else None
+    transitions = ReplayBuffer.load(replay_path).view()
+    # A ring buffer that wrapped may start mid-episode; skip to the first whole episode.
+    first = int(np.argmax(transitions.steps == 0))
+    transitions = type(transitions)(*(column[first:] for column in transitions))
+    for _ in range(passes):
+        batch_update_q_table(transitions, q_table, alpha=alpha, gamma=gamma, symmetry=symmetry)
+    return q_table
 
 if __name__ == "__main__":
     q_table = train_against_random()
\ No newline at end of file
@@ -1,10 +1,22 @@
+import threading
 import pygame
 
 class Visualizer:
-    def __init__(self, gui=True):
+    """Draws the board with pygame, repainting only what changed since the last frame.
+
+    Each occupied cell is drawn from a cached tile keyed by (symbol, age,
+    lifespan), so fonts are only rendered the first time a tile is needed,
+    and pygame.display.update gets just the cells, turn line and banner that
+    changed. With threaded set, refresh() hands the frame to a render thread
+    and returns at once; SDL only supports drawing off the main thread on
+    some platforms (not macOS), so it is off by default.
+    """
+
+    def __init__(self, gui=True, grid_size=3, threaded=False):
         self.gui = gui
-        self.cell_size = 200
-        self.grid_size = 3
+        self.grid_size = grid_size
+        self.cell_size = min(200, 600 // grid_size)  # Keep the window near 600px wide on large boards
+        self.scale = self.cell_size / 200  # Symbol sizes and offsets were laid out for 200px cells
         self.width = self.grid_size * self.cell_size
         self.height = self.width + 120
         self.colors = {
@@ -16,81 +28,187 @@ class Visualizer:
             "PLAYER2": (255, 99, 71),    # O
         }
         self.screen = None
+        self.tiles = {}
+        self.drawn = None  # Frame currently on screen, or None before the first one; only _draw changes it
+        self.last_frame = None
+        self.threaded = gui and threaded
         if self.gui:
             pygame.init()
             self.screen = pygame.display.set_mode((self.width, self.height))
             pygame.display.set_caption("Ephemeral Tic-Tac-Toe")
             self.font = pygame.font.SysFont('arial', 48)
             self.small_font = pygame.font.SysFont('arial', 30)
-            self.clock = pygame.time.Clock()
+            self.symbol_font = pygame.font.SysFont('arial', max(12, round(48 * self.scale)))
+            self.age_font = pygame.font.SysFont('arial', max(10, round(30 * self.scale)))
             self.screen.fill(self.colors["WHITE"])  # Initialize with white background
             pygame.display.flip()
+        if self.threaded:
+            self.pending = None
+            self.repaint_all = False  # Set by redraw(), cleared by the render thread
+            self.running = True
+            self.frame_ready = threading.Condition()
+            self.render_thread = threading.Thread(target=self._render_loop, daemon=True)
+            self.render_thread.start()
 
     def draw_grid(self):
         for i in range(1, self.grid_size):
             pygame.draw.line(self.screen, self.colors["GRAY"], (i * self.cell_size, 0), (i * self.cell_size, self.width), 5)
             pygame.draw.line(self.screen, self.colors["GRAY"], (0, i * self.cell_size), (self.width, i * self.cell_size), 5)
 
-    def draw_symbols(self, env):
-        for i in range(self.grid_size):
-            for j in range(self.grid_size):
-                symbol = env.board[i, j]
-                if symbol:
-                    age = env.ages[i, j]
-                    lifespan = env.lifespan_x if symbol == 'X' else env.lifespan_o
-                    center_x = j * self.cell_size + self.cell_size // 2
-                    center_y = i * self.cell_size + self.cell_size // 2
-
-                    if age >= lifespan:  # Expired piece: draw a cross
-                        pygame.draw.line(self.screen, self.colors["BLACK"], 
-                                        (center_x - 30, center_y - 30), (center_x + 30, center_y + 30), 5)
-                        pygame.draw.line(self.screen, self.colors["BLACK"], 
-                                        (center_x - 30, center_y + 30), (center_x + 30, center_y - 30), 5)
-                    else:  # Active piece: draw symbol and lifespan circles
-                        alpha = max(255 - (255 * age // lifespan), 50)
-                        color = self.colors["PLAYER1"] if symbol == "X" else self.colors["PLAYER2"]
-                        symbol_surface = self.font.render(symbol, True, color)
-                        symbol_surface.set_alpha(alpha)
-                        rect = symbol_surface.get_rect(center=(center_x, center_y))
-                        self.screen.blit(symbol_surface, rect)
-
-                        # Draw lifespan circles (up to 3, based on remaining lifespan)
-                        remaining_life = lifespan - age
-                        circles = min(3, max(0, int(remaining_life / (lifespan / 3.0))))
-                        for c in range(circles):
-                            pygame.draw.circle(self.screen, color, 
-                                             (center_x - 30 + c * 30, center_y - 50), 10)
-
-                    # Draw age below the symbol
-                    age_surface = self.small_font.render(str(age), True, self.colors["BLACK"])
-                    age_rect = age_surface.get_rect(center=(center_x, center_y + 40))
-                    self.screen.blit(age_surface, age_rect)
-
-    def display_turn_info(self, env):
-        info_surface = self.small_font.render(f"Current Turn: {env.current_player}", True, self.colors["DARK_GRAY"])
-        rect = info_surface.get_rect(center=(self.width // 2, self.height - 60))
-        self.screen.blit(info_surface, rect)
+    def cell_at(self, x, y):
+        """Action index of the cell under screen position (x, y), or None if outside the board."""
+        row, col = y // self.cell_size, x // self.cell_size
+        if 0 <= row < self.grid_size and 0 <= col < self.grid_size:
+            return row * self.grid_size + col
+        return None
+
+    def _tile(self, symbol, age, lifespan):
+        """Cell-sized surface showing a piece of `symbol` at `age`, rendered once and cached."""
+        key = (symbol, age, lifespan)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            return tile
+        tile = pygame.Surface((self.cell_size, self.cell_size))
+        tile.fill(self.colors["WHITE"])
+        s = lambda offset: round(offset * self.scale)
+        center_x = center_y = self.cell_size // 2
+        if age >= lifespan:  # Expired piece: draw a cross
+            pygame.draw.line(tile, self.colors["BLACK"],
+                             (center_x - s(30), center_y - s(30)), (center_x + s(30), center_y + s(30)), 5)
+            pygame.draw.line(tile, self.colors["BLACK"],
+                             (center_x - s(30), center_y + s(30)), (center_x + s(30), center_y - s(30)), 5)
+        else:  # Active piece: draw symbol and lifespan circles
+            alpha = max(255 - (255 * age // lifespan), 50)
+            color = self.colors["PLAYER1"] if symbol == "X" else self.colors["PLAYER2"]
+            symbol_surface = self.symbol_font.render(symbol, True, color)
+            symbol_surface.set_alpha(alpha)
+            tile.blit(symbol_surface, symbol_surface.get_rect(center=(center_x, center_y)))
+
+            # Draw lifespan circles (up to 3, based on remaining lifespan)
+            remaining_life = lifespan - age
+            circles = min(3, max(0, int(remaining_life / (lifespan / 3.0))))
+            for c in range(circles):
+                pygame.draw.circle(tile, color, (center_x - s(30) + c * s(30), center_y - s(50)), s(10))
+
+        # Draw age below the symbol
+        age_surface = self.age_font.render(str(age), True, self.colors["BLACK"])
+        tile.blit(age_surface, age_surface.get_rect(center=(center_x, center_y + s(40))))
+        self.tiles[key] = tile
+        return tile
+
+    def _frame(self, reward, done, info, env):
+        """What to show for env: a tile key (or None) per cell, the player to move and the banner text."""
+        lifespans = {"X": env.lifespan_x, "O": env.lifespan_o}
+        cells = tuple((symbol, age, lifespans[symbol]) if symbol else None
+                      for symbol, age in zip(env.board.ravel().tolist(), env.ages.ravel().tolist()))
+        banner = None
+        if done:
+            banner = f"Winner: {info['player']}!" if reward == 1 else "It's a Draw!"
+        return cells, env.current_player, banner
 
     def refresh(self, obs, reward, done, info, env, action_history):
         if not self.gui:
             return
-        self.screen.fill(self.colors["WHITE"])  # Clear screen with white background
+        self._show(self._frame(reward, done, info, env))
+
+    def redraw(self):
+        """Repaint the whole window, e.g. after it was uncovered."""
+        if self.last_frame is not None:
+            self._show(self.last_frame, full=True)
+
+    def _show(self, frame, full=False):
+        self.last_frame = frame
+        if not self.threaded:
+            self._draw(frame, full)
+            return
+        with self.frame_ready:  # Frames the render thread has not reached yet are dropped
+            self.pending = frame
+            self.repaint_all = self.repaint_all or full
+            self.frame_ready.notify()
+
+    def _render_loop(self):
+        while True:
+            with self.frame_ready:
+                while self.pending is None and self.running:
+                    self.frame_ready.wait()
+                if not self.running:
+                    return
+                frame, self.pending = self.pending, None
+                full, self.repaint_all = self.repaint_all, False
+            self._draw(frame, full)
+
+    def _repaint(self, rect):
+        """Clear rect to the background, grid lines included, and return it."""
+        self.screen.set_clip(rect)
+        self.screen.fill(self.colors["WHITE"])
         self.draw_grid()
-        self.draw_symbols(env)
-        self.display_turn_info(env)
+        self.screen.set_clip(None)
+        return rect
 
-        if done:
-            if reward == 1:
-                winner_text = f"Winner: {info['player']}!"
-            else:
-                winner_text = "It's a Draw!"
-            winner_surface = self.font.render(winner_text, True, self.colors["BLACK"])
+    def _draw(self, frame, full=False):
+        """Paint frame, updating only the screen areas that differ from the frame on screen unless full."""
+        cells, player, banner = frame
+        drawn = self.drawn
+        full = full or drawn is None
+        dirty = []
+        banner_rect = None
+        if not full:
+            old_cells, old_player, old_banner = drawn
+            if old_banner is not None and old_banner != banner:
+                full = True  # The old banner covers several cells
+        if full:
+            self.screen.fill(self.colors["WHITE"])
+            self.draw_grid()
+            old_cells, old_player = (None,) * len(cells), None
+
+        size = self.cell_size
+        for cell, (tile_key, old_key) in enumerate(zip(cells, old_cells)):
+            if tile_key != old_key or full:
+                row, col = divmod(cell, self.grid_size)
+                rect = pygame.Rect(col * size, row * size, size, size)
+                if tile_key is None:
+                    self._repaint(rect)
+                else:  # The tile's background covers the grid lines on the cell's edges, so draw them again
+                    self.screen.set_clip(rect)
+                    self.screen.blit(self._tile(*tile_key), rect)
+                    self.draw_grid()
+                    self.screen.set_clip(None)
+                dirty.append(rect)
+
+        if player != old_player or full:
+            rect = self._repaint(pygame.Rect(0, self.width, self.width, self.height - self.width))
+            info_surface = self.small_font.render(f"Current Turn: {player}", True, self.colors["DARK_GRAY"])
+            self.screen.blit(info_surface, info_surface.get_rect(center=(self.width // 2, self.height - 60)))
+            dirty.append(rect)
+
+        if banner is not None:
+            winner_surface = self.font.render(banner, True, self.colors["BLACK"])
             winner_rect = winner_surface.get_rect(center=(self.width // 2, self.height // 2))
-            pygame.draw.rect(self.screen, self.colors["WHITE"], winner_rect.inflate(20, 20))
-            self.screen.blit(winner_surface, winner_rect)
+            banner_rect = winner_rect.inflate(20, 20)
+            if full or banner != drawn[2] or banner_rect.collidelist(dirty) >= 0:
+                pygame.draw.rect(self.screen, self.colors["WHITE"], banner_rect)
+                self.screen.blit(winner_surface, winner_rect)
+                dirty.append(banner_rect)
 
-        pygame.display.flip()
-        self.clock.tick(60)
+        self.drawn = frame
+        if full:
+            pygame.display.flip()
+        elif dirty:
+            pygame.display.update(dirty)
+
+    def wait_for_click(self, legal_actions):
+        """Sleep until a legal cell is clicked and return its action; the window stays responsive meanwhile."""
+        while True:
+            event = pygame.event.wait()
+            if event.type == pygame.QUIT:
+                self.close()
+                raise SystemExit
+            if event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                self.redraw()
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                action = self.cell_at(*event.pos)
+                if action in legal_actions:
+                    return action
 
     def check_quit(self):
         if not self.gui:
@@ -99,7 +217,51 @@ class Visualizer:
             if event.type == pygame.QUIT:
                 self.close()
                 raise SystemExit
+            if event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                self.redraw()
 
     def close(self):
+        if self.threaded:
+            with self.frame_ready:
+                self.running = False
+                self.frame_ready.notify()
+            if self.render_thread is not threading.current_thread():
+                self.render_thread.join()
+            self.threaded = False
         if self.gui:
-            pygame.quit()
\ No newline at end of file
+            pygame.quit()
+
+class TrainingRenderer:
+    """Draws training episodes: every `visualize_every`-th game is shown move by move.
+
+    With threaded set, moves are drawn on the visualizer's render thread and
+    training does not pause to show them, so the window shows the latest
+    position whenever it catches up.
+    """
+    def __init__(self, env, visualize_every=1, threaded=False):
+        self.env = env
+        self.visualize_every = visualize_every
+        self.threaded = threaded
+        self.visualizer = Visualizer(gui=True, grid_size=env.grid_size, threaded=threaded)
+
+    def _visualized(self, episode):
+        return episode % self.visualize_every == 0
+
+    def step_hook(self, episode):
+        """Callback for play_episode, or None if this episode is not drawn."""
+        if not self._visualized(episode):
+            return None
+
+        def on_step(next_obs, reward, done, info):
+            self.visualizer.refresh(next_obs, reward, done, info, self.env, [None, None, None])
+            if not self.threaded:
+                pygame.time.wait(500)
+        return on_step
+
+    def end_episode(self, episode):
+        self.visualizer.check_quit()
+        if self._visualized(episode) and not self.threaded:
+            pygame.time.wait(1000)
+
+    def close(self):
+        self.visualizer.close()